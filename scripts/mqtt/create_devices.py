@@ -6,9 +6,12 @@ import csv
 import json
 import os
 import re
+import secrets
 import sys
+import threading
 import time
 from pathlib import Path
+from typing import Any, Callable, Optional, TextIO, Tuple
 
 from dotenv import load_dotenv
 
@@ -31,6 +34,12 @@ DEVICE_LABEL = os.getenv("DEVICE_LABEL", "sim-lab")
 DEVICE_TYPE = os.getenv("DEVICE_TYPE", "sensor")
 PROFILE_ID = os.getenv("DEVICE_PROFILE_ID")
 NAME_PATTERN = re.compile(rf"^{re.escape(DEVICE_PREFIX)}-(\d+)$")
+# TB.map limita los hilos al pool de conexiones de la sesión (tb.POOL_SIZE).
+PROVISION_WORKERS = int(os.getenv("PROVISION_WORKERS", "8"))
+PROVISION_RATE = float(os.getenv("PROVISION_RATE", "200"))
+# En una re-ejecución los dispositivos ya existen: se consultan antes de intentar
+# crearlos. Por defecto se asume así cuando ya hay un tokens.json previo.
+PROVISION_ASSUME_EXISTS = os.getenv("PROVISION_ASSUME_EXISTS", "")
 
 
 def fail(msg: str, code: int = 1) -> None:
@@ -42,73 +51,145 @@ def ensure_dir(path: Path) -> None:
     path.mkdir(parents=True, exist_ok=True)
 
 
+class RateLimiter:
+    """Token bucket compartido por los hilos de aprovisionamiento."""
+
+    def __init__(self, rate: float) -> None:
+        self.rate = max(rate, 0.1)
+        self.capacity = max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def call_tb(limiter: RateLimiter, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Llama a la API respetando el límite de tasa; los 429 los reintenta la sesión de TB."""
+    limiter.acquire()
+    return func(*args, **kwargs)
+
+
+def provision(writer: Any, tokens_handle: TextIO) -> int:
+    """Crea o recupera los dispositivos y escribe cada fila en cuanto está lista."""
+    count = 0
+    with TB(TB_URL, TB_USERNAME, TB_PASSWORD) as api:
+        api.login()
+        profile_id = PROFILE_ID or api.default_profile()
+        if profile_id:
+            msg = "fijado" if PROFILE_ID else "por defecto"
+            print(f"[INFO] Device Profile {msg}: {profile_id}")
+        else:
+            print("[INFO] No se encontró Device Profile por defecto")
+
+        limiter = RateLimiter(PROVISION_RATE)
+        if PROVISION_ASSUME_EXISTS:
+            assume_exists = PROVISION_ASSUME_EXISTS == "1"
+        else:
+            assume_exists = TOKENS_FILE.exists()
+        batch = "sim-" + time.strftime("%Y%m%d")
+
+        def _provision(api: TB, idx: int) -> Tuple[str, str, str, str, Optional[str]]:
+            expected_name = f"{DEVICE_PREFIX}-{idx:03d}"
+            print(f"[INFO] Creando/recuperando '{expected_name}'...")
+            # El token se fija al crear el dispositivo; sólo los ya existentes
+            # requieren consultar sus credenciales.
+            new_token = secrets.token_hex(10)
+            device, created = call_tb(
+                limiter,
+                api.create_device,
+                expected_name,
+                label=DEVICE_LABEL,
+                dev_type=DEVICE_TYPE,
+                profile_id=profile_id,
+                access_token=new_token,
+                assume_exists=assume_exists,
+            )
+            dev_id = device["id"]["id"]
+            token = new_token if created else call_tb(limiter, api.token, dev_id)
+            actual_name = device.get("name", expected_name)
+            match = NAME_PATTERN.fullmatch(actual_name)
+            if not match:
+                return dev_id, actual_name, "", token, (
+                    f"El dispositivo '{actual_name}' no cumple el patrón '{DEVICE_PREFIX}-NNN'. "
+                    "Elimina manualmente los dispositivos con nombres inválidos e intenta de nuevo."
+                )
+            number = int(match.group(1))
+            if number != idx:
+                return dev_id, actual_name, "", token, (
+                    f"El dispositivo '{actual_name}' no corresponde al índice esperado {idx}. "
+                    "Asegúrate de no tener dispositivos duplicados o fuera de secuencia."
+                )
+            call_tb(
+                limiter,
+                api.set_attrs,
+                dev_id,
+                {
+                    "batch": batch,
+                    "group": DEVICE_PREFIX,
+                    "index": idx,
+                },
+            )
+            return dev_id, expected_name, device.get("label", ""), token, None
+
+        # TB.map conserva el orden de los índices, así el CSV queda ordenado.
+        for dev_id, name, label, token, error in api.map(
+            _provision, range(1, DEVICE_COUNT + 1), PROVISION_WORKERS
+        ):
+            if error is not None:
+                fail(error)
+            writer.writerow([dev_id, name, label, token])
+            tokens_handle.write(
+                f"{',' if count else ''}\n  "
+                f"{json.dumps(name, ensure_ascii=False)}: {json.dumps(token, ensure_ascii=False)}"
+            )
+            count += 1
+    return count
+
+
 def main() -> None:
     if not TB_URL or not TB_USERNAME or not TB_PASSWORD:
         fail("Config .env incompleta (TB_URL, TB_USERNAME, TB_PASSWORD)")
 
     ensure_dir(PROVISION_DIR)
 
-    tokens_map: dict[str, str] = {}
-    rows: list[list[str]] = []
+    # Las filas se escriben a medida que llegan en archivos temporales que sólo
+    # reemplazan a los definitivos si el aprovisionamiento termina bien.
+    csv_tmp = CSV_FILE.with_name(f".{CSV_FILE.name}.tmp")
+    tokens_tmp = TOKENS_FILE.with_name(f".{TOKENS_FILE.name}.tmp")
     started = time.time()
 
     try:
-        with TB(TB_URL, TB_USERNAME, TB_PASSWORD) as api:
-            api.login()
-            profile_id = PROFILE_ID or api.default_profile()
-            if profile_id:
-                msg = "fijado" if PROFILE_ID else "por defecto"
-                print(f"[INFO] Device Profile {msg}: {profile_id}")
-            else:
-                print("[INFO] No se encontró Device Profile por defecto")
-
-            for idx in range(1, DEVICE_COUNT + 1):
-                expected_name = f"{DEVICE_PREFIX}-{idx:03d}"
-                print(f"[INFO] Creando/recuperando '{expected_name}'...")
-                device = api.save_device(
-                    expected_name,
-                    label=DEVICE_LABEL,
-                    dev_type=DEVICE_TYPE,
-                    profile_id=profile_id,
-                )
-                dev_id = device["id"]["id"]
-                token = api.token(dev_id)
-                actual_name = device.get("name", expected_name)
-                match = NAME_PATTERN.fullmatch(actual_name)
-                if not match:
-                    fail(
-                        f"El dispositivo '{actual_name}' no cumple el patrón '{DEVICE_PREFIX}-NNN'. "
-                        "Elimina manualmente los dispositivos con nombres inválidos e intenta de nuevo."
-                    )
-                number = int(match.group(1))
-                if number != idx:
-                    fail(
-                        f"El dispositivo '{actual_name}' no corresponde al índice esperado {idx}. "
-                        "Asegúrate de no tener dispositivos duplicados o fuera de secuencia."
-                    )
-                tokens_map[expected_name] = token
-                rows.append([dev_id, expected_name, device.get("label", ""), token])
-                api.set_attrs(
-                    dev_id,
-                    {
-                        "batch": "sim-" + time.strftime("%Y%m%d"),
-                        "group": DEVICE_PREFIX,
-                        "index": idx,
-                    },
-                )
-
-    except TBError as exc:
-        fail(str(exc))
-
-    TOKENS_FILE.write_text(json.dumps(tokens_map, ensure_ascii=False, indent=2), encoding="utf-8")
-    with CSV_FILE.open("w", newline="", encoding="utf-8") as handle:
-        writer = csv.writer(handle)
-        writer.writerow(["device_id", "name", "label", "access_token"])
-        writer.writerows(rows)
+        with csv_tmp.open("w", newline="", encoding="utf-8") as csv_handle, tokens_tmp.open(
+            "w", encoding="utf-8"
+        ) as tokens_handle:
+            writer = csv.writer(csv_handle)
+            writer.writerow(["device_id", "name", "label", "access_token"])
+            tokens_handle.write("{")
+            try:
+                count = provision(writer, tokens_handle)
+            except TBError as exc:
+                fail(str(exc))
+            tokens_handle.write("\n}" if count else "}")
+        os.replace(tokens_tmp, TOKENS_FILE)
+        os.replace(csv_tmp, CSV_FILE)
+    finally:
+        csv_tmp.unlink(missing_ok=True)
+        tokens_tmp.unlink(missing_ok=True)
 
     elapsed = time.time() - started
     print(
-        f"[OK] {len(rows)} dispositivos. Tokens en: {TOKENS_FILE}. CSV en: {CSV_FILE}. Tiempo: {elapsed:.1f}s"
+        f"[OK] {count} dispositivos. Tokens en: {TOKENS_FILE}. CSV en: {CSV_FILE}. Tiempo: {elapsed:.1f}s"
     )
 
 
@@ -21,6 +21,8 @@ TB_PARENT_USERNAME = os.getenv("TB_PARENT_USERNAME") or TB_USERNAME
 TB_PARENT_PASSWORD = os.getenv("TB_PARENT_PASSWORD") or TB_PASSWORD
 PREFIX = os.getenv("DEVICE_PREFIX", "sim")
 PAGE_SIZE = 200
+# Borrados simultáneos por servidor; comparten el pool de conexiones de la sesión.
+DELETE_WORKERS = int(os.getenv("DELETE_WORKERS", "8"))
 
 
 def fail(msg: str, code: int = 1) -> None:
@@ -55,14 +57,13 @@ def list_devices(api: TB) -> Iterable[Dict[str, object]]:
         page += 1
 
 
-def delete_device(api: TB, device_id: str, name: str, scope: str) -> None:
-    resp = api.session.delete(f"{api.base}/api/device/{device_id}", timeout=api.timeout)
-    if resp.status_code == 200:
-        print(f"[{scope}] [DEL] {name}")
-    elif resp.status_code == 404:
-        print(f"[{scope}] [WARN] {name} ya no existe")
-    else:
-        print(f"[{scope}] [WARN] No se pudo borrar {name}: {resp.status_code} {resp.text}")
+def delete_line(name: str, status: int, detail: str, scope: str) -> str:
+    """Línea de log para el resultado del borrado del dispositivo ``name``."""
+    if status == 200:
+        return f"[{scope}] [DEL] {name}"
+    if status == 404:
+        return f"[{scope}] [WARN] {name} ya no existe"
+    return f"[{scope}] [WARN] No se pudo borrar {name}: {status} {detail}"
 
 
 def main() -> None:
@@ -80,9 +81,9 @@ def main() -> None:
                     if name.startswith(PREFIX):
                         matches[str(device["id"]["id"])] = device
                 print(f"[{scope}] [INFO] Encontrados {len(matches)} dispositivos con prefijo '{PREFIX}'")
-                for device_id, device in matches.items():
-                    name = str(device.get("name", device_id))
-                    delete_device(api, device_id, name, scope)
+                for device_id, status, detail in api.delete_devices(matches, DELETE_WORKERS):
+                    name = str(matches[device_id].get("name", device_id))
+                    print(delete_line(name, status, detail, scope))
     except TBError as exc:
         fail(str(exc))
 
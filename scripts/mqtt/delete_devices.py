@@ -24,6 +24,8 @@ TB_PASSWORD = os.getenv("TB_PASSWORD")
 TB_PARENT_URL = os.getenv("TB_PARENT_URL", "").rstrip("/")
 TB_PARENT_USERNAME = os.getenv("TB_PARENT_USERNAME") or TB_USERNAME
 TB_PARENT_PASSWORD = os.getenv("TB_PARENT_PASSWORD") or TB_PASSWORD
+# Borrados simultáneos por servidor; comparten el pool de conexiones de la sesión.
+DELETE_WORKERS = int(os.getenv("DELETE_WORKERS", "8"))
 
 
 def fail(msg: str, code: int = 1) -> None:
@@ -42,14 +44,13 @@ def configured_clients() -> List[Tuple[str, TB]]:
     return clients
 
 
-def delete_device(api: TB, dev_id: str, scope: str) -> None:
-    resp = api.session.delete(f"{api.base}/api/device/{dev_id}", timeout=api.timeout)
-    if resp.status_code == 200:
-        print(f"[{scope}] [OK] Borrado {dev_id}")
-    elif resp.status_code == 404:
-        print(f"[{scope}] [WARN] {dev_id} ya no existe")
-    else:
-        print(f"[{scope}] [WARN] No se pudo borrar {dev_id}: {resp.status_code} {resp.text}")
+def delete_line(dev_id: str, status: int, detail: str, scope: str) -> str:
+    """Línea de log para el resultado del borrado de ``dev_id``."""
+    if status == 200:
+        return f"[{scope}] [OK] Borrado {dev_id}"
+    if status == 404:
+        return f"[{scope}] [WARN] {dev_id} ya no existe"
+    return f"[{scope}] [WARN] No se pudo borrar {dev_id}: {status} {detail}"
 
 
 def main() -> None:
@@ -63,11 +64,10 @@ def main() -> None:
                 print(f"[INFO] Autenticando en {scope} ({api.base})...")
                 api.login()
             with CSV_FILE.open(newline="", encoding="utf-8") as handle:
-                reader = csv.DictReader(handle)
-                for row in reader:
-                    dev_id = row["device_id"]
-                    for scope, api in clients:
-                        delete_device(api, dev_id, scope)
+                dev_ids = [row["device_id"] for row in csv.DictReader(handle)]
+            for scope, api in clients:
+                for dev_id, status, detail in api.delete_devices(dev_ids, DELETE_WORKERS):
+                    print(delete_line(dev_id, status, detail, scope))
     except TBError as exc:
         fail(str(exc))
 
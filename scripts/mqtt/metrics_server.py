@@ -2,12 +2,39 @@
 """Flask dashboard for ThingsBoard telemetry simulator metrics."""
 from __future__ import annotations
 
+import gzip
+import heapq
+import json
+import secrets
 import threading
-from typing import Any, Optional
-
-from flask import Flask, jsonify, render_template_string, request
-from werkzeug.serving import make_server
-
+import time
+from collections import deque
+from typing import Any, Iterator, Optional, Sequence
+
+from flask import Flask, Response, render_template_string, request
+from werkzeug.exceptions import BadRequest
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stdlib json module.
+    orjson = None  # type: ignore[assignment]
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; the page is still served gzip-compressed.
+    brotli = None  # type: ignore[assignment]
+
+# Smaller metrics bodies are not worth compressing.
+GZIP_MIN_BYTES = 1024
+# Devices listed in the dashboard table; /api/metrics only ships these.
+DASHBOARD_DEVICE_LIMIT = 10
+# Samples kept for /api/metrics/history (one per refresh interval).
+HISTORY_LIMIT = 10_000
+# Upper bound on the points /api/metrics/history returns per series.
+HISTORY_MAX_POINTS = 2_000
+# Seconds an idle event stream waits for a shard report before sending a keep-alive.
+SSE_KEEPALIVE_SECONDS = 15.0
 
 DASHBOARD_TEMPLATE = """
 <!DOCTYPE html>
@@ -87,7 +114,8 @@ DASHBOARD_TEMPLATE = """
     <div class="card">
       <h2>Disconnect causes</h2>
       <table id="disconnect-table">
-        <tr><th>Reason</th><th>Count</th></tr>
+        <thead><tr><th>Reason</th><th>Count</th></tr></thead>
+        <tbody></tbody>
       </table>
     </div>
   </div>
@@ -110,7 +138,8 @@ DASHBOARD_TEMPLATE = """
   <div class="card">
     <h2>Top devices (by messages sent)</h2>
     <table id="devices-table">
-      <tr><th>Device</th><th>Messages</th><th>Failed</th></tr>
+      <thead><tr><th>Device</th><th>Messages</th><th>Failed</th></tr></thead>
+      <tbody></tbody>
     </table>
   </div>
 
@@ -118,54 +147,52 @@ DASHBOARD_TEMPLATE = """
 
   <script>
     const refreshInterval = {{ refresh_interval }};
-    const messagesCtx = document.getElementById('messagesChart').getContext('2d');
-    const bandwidthCtx = document.getElementById('bandwidthChart').getContext('2d');
-    const latencyCtx = document.getElementById('latencyChart').getContext('2d');
-    const maxPoints = 60;
-
-    const chartConfig = (label, color) => ({
-      type: 'line',
-      data: { labels: [], datasets: [{ label, borderColor: color, backgroundColor: color, tension: 0.2, data: [], fill: false }] },
-      options: {
-        animation: false,
-        responsive: true,
-        maintainAspectRatio: false,
-        scales: {
-          x: { ticks: { color: '#9ca6b4' }, grid: { color: 'rgba(255,255,255,0.05)' } },
-          y: { ticks: { color: '#9ca6b4' }, grid: { color: 'rgba(255,255,255,0.05)' }, beginAtZero: true }
-        },
-        plugins: {
-          legend: { labels: { color: '#f2f4f8' } }
-        }
-      }
+    // Every element with an id, looked up once; 'total-devices' becomes EL.totalDevices.
+    const EL = {};
+    document.querySelectorAll('[id]').forEach(el => {
+      EL[el.id.replace(/-([a-z0-9])/g, (_, c) => c.toUpperCase())] = el;
     });
-
-    const messagesChart = new Chart(messagesCtx, chartConfig('Messages/s', '#4fd1c5'));
-    const bandwidthChart = new Chart(bandwidthCtx, chartConfig('Bandwidth Mbps', '#f6ad55'));
-    const latencyChart = new Chart(latencyCtx, {
-      type: 'line',
-      data: {
-        labels: [],
-        datasets: [
-          { label: 'Avg', borderColor: '#63b3ed', backgroundColor: '#63b3ed', tension: 0.2, data: [], fill: false },
-          { label: 'P95', borderColor: '#f6ad55', backgroundColor: '#f6ad55', tension: 0.2, data: [], fill: false },
-          { label: 'P99', borderColor: '#fc8181', backgroundColor: '#fc8181', tension: 0.2, data: [], fill: false }
-        ]
-      },
-      options: {
-        animation: false,
-        responsive: true,
-        maintainAspectRatio: false,
-        scales: {
-          x: { ticks: { color: '#9ca6b4' }, grid: { color: 'rgba(255,255,255,0.05)' } },
-          y: { ticks: { color: '#9ca6b4' }, grid: { color: 'rgba(255,255,255,0.05)' }, beginAtZero: true }
+    const messagesCtx = EL.messagesChart.getContext('2d');
+    const bandwidthCtx = EL.bandwidthChart.getContext('2d');
+    const latencyCtx = EL.latencyChart.getContext('2d');
+    // Raw points kept per series; the decimation plugin draws about one per pixel.
+    const maxPoints = 5000;
+    const gridColor = 'rgba(255,255,255,0.05)';
+
+    const lineOptions = () => ({
+      animation: false,
+      responsive: true,
+      maintainAspectRatio: false,
+      parsing: false,
+      normalized: true,
+      spanGaps: true,
+      devicePixelRatio: Math.min(window.devicePixelRatio || 1, 2),
+      elements: { point: { radius: 0 } },
+      scales: {
+        x: {
+          type: 'linear',
+          ticks: { color: '#9ca6b4', maxTicksLimit: 8, callback: value => new Date(value).toLocaleTimeString() },
+          grid: { color: gridColor }
         },
-        plugins: {
-          legend: { labels: { color: '#f2f4f8' } }
-        }
+        y: { ticks: { color: '#9ca6b4' }, grid: { color: gridColor }, beginAtZero: true }
+      },
+      plugins: {
+        decimation: { enabled: true, algorithm: 'min-max' },
+        legend: { labels: { color: '#f2f4f8' } }
       }
     });
 
+    const lineDataset = (label, color) => ({ label, borderColor: color, backgroundColor: color, tension: 0.2, data: [], fill: false });
+    const chartConfig = (...datasets) => ({ type: 'line', data: { datasets }, options: lineOptions() });
+
+    const messagesChart = new Chart(messagesCtx, chartConfig(lineDataset('Messages/s', '#4fd1c5')));
+    const bandwidthChart = new Chart(bandwidthCtx, chartConfig(lineDataset('Bandwidth Mbps', '#f6ad55')));
+    const latencyChart = new Chart(latencyCtx, chartConfig(
+      lineDataset('Avg', '#63b3ed'),
+      lineDataset('P95', '#f6ad55'),
+      lineDataset('P99', '#fc8181')
+    ));
+
     async function fetchMetrics() {
       try {
         const response = await fetch('/api/metrics');
@@ -178,98 +205,94 @@ DASHBOARD_TEMPLATE = """
     }
 
     function updateDashboard(data) {
-      const metrics = data.metrics || {};
-      const elapsedSeconds = metrics.elapsed_seconds ?? 0;
-      const success = metrics.successful_publishes ?? 0;
-      const failed = metrics.failed_publishes ?? 0;
+      // The server sends every metric as a number (0 / -1 instead of null),
+      // so these reads never mix types.
+      const metrics = data.metrics;
+      const success = metrics.successful_publishes;
+      const failed = metrics.failed_publishes;
       const totalMsgs = success + failed;
-      const successRate = totalMsgs > 0 ? (success / totalMsgs) * 100 : null;
-      const bandwidth = metrics.bandwidth_mbps ?? 0;
-      const disconnectCauses = metrics.disconnect_causes || {};
-      const disconnectEvents = Object.values(disconnectCauses).reduce((acc, value) => acc + Number(value || 0), 0);
-
-      document.getElementById('elapsed').innerText = formatSeconds(elapsedSeconds);
-      document.getElementById('mps').innerText = metrics.messages_per_second !== undefined ? metrics.messages_per_second.toFixed(3) : '--';
-      document.getElementById('bandwidth').innerText = bandwidth.toFixed(4);
-      document.getElementById('channels').innerText = metrics.channels_in_use ?? '--';
-      document.getElementById('success-pill').innerText = successRate !== null ? successRate.toFixed(1) + '%' : '--';
-
-      document.getElementById('total-devices').innerText = metrics.total_devices ?? '--';
-      document.getElementById('connected').innerText = metrics.connected_devices ?? '--';
-      document.getElementById('peak-connected').innerText = metrics.peak_connected_devices ?? '--';
-      document.getElementById('failed-devices').innerText = metrics.failed_devices ?? '--';
-      document.getElementById('collapse-time').innerText = metrics.collapse_time_seconds != null ? metrics.collapse_time_seconds.toFixed(1) + ' s' : 'N/A';
-      document.getElementById('collapse-reason').innerText = metrics.collapse_reason ?? 'N/A';
-
-      document.getElementById('packets-sent').innerText = success;
-      document.getElementById('packets-failed').innerText = failed;
-      document.getElementById('volume').innerText = metrics.data_volume_mb != null ? metrics.data_volume_mb.toFixed(3) : '--';
-      document.getElementById('avg-msgs-device').innerText = metrics.avg_messages_per_device != null ? metrics.avg_messages_per_device.toFixed(2) : '--';
-      document.getElementById('avg-rate-device').innerText = metrics.avg_send_rate_per_device != null ? metrics.avg_send_rate_per_device.toFixed(3) : '--';
-
-      document.getElementById('success-rate').innerText = successRate !== null ? successRate.toFixed(2) + '%' : '--';
-      document.getElementById('failed-devices-secondary').innerText = metrics.failed_devices ?? '--';
-      document.getElementById('disconnect-events').innerText = disconnectEvents;
-      document.getElementById('latency-mps').innerText = metrics.messages_per_second != null ? metrics.messages_per_second.toFixed(3) : '--';
-      document.getElementById('latency-bw').innerText = bandwidth.toFixed(4);
-
-      document.getElementById('latency-avg').innerText = metrics.avg_latency_ms != null ? metrics.avg_latency_ms.toFixed(3) : '--';
-      document.getElementById('latency-p50').innerText = metrics.p50_latency_ms != null ? metrics.p50_latency_ms.toFixed(3) : '--';
-      document.getElementById('latency-p95').innerText = metrics.p95_latency_ms != null ? metrics.p95_latency_ms.toFixed(3) : '--';
-      document.getElementById('latency-p99').innerText = metrics.p99_latency_ms != null ? metrics.p99_latency_ms.toFixed(3) : '--';
-
-      updateTable('disconnect-table', disconnectCauses, ['Reason', 'Count']);
-      updateDeviceTable(data.devices || []);
-      pushChartPoint(messagesChart, metrics.messages_per_second ?? 0);
+      const successRate = totalMsgs > 0 ? (success / totalMsgs) * 100 : -1;
+      const bandwidth = metrics.bandwidth_mbps;
+      const disconnectCauses = metrics.disconnect_causes;
+      const disconnectEvents = Object.values(disconnectCauses).reduce((acc, value) => acc + value, 0);
+
+      EL.elapsed.textContent = formatSeconds(metrics.elapsed_seconds);
+      EL.mps.textContent = metrics.messages_per_second.toFixed(3);
+      EL.bandwidth.textContent = bandwidth.toFixed(4);
+      EL.channels.textContent = metrics.channels_in_use;
+      EL.successPill.textContent = successRate >= 0 ? successRate.toFixed(1) + '%' : '--';
+
+      EL.totalDevices.textContent = metrics.total_devices;
+      EL.connected.textContent = metrics.connected_devices;
+      EL.peakConnected.textContent = metrics.peak_connected_devices;
+      EL.failedDevices.textContent = metrics.failed_devices;
+      EL.collapseTime.textContent = metrics.collapse_time_seconds >= 0 ? metrics.collapse_time_seconds.toFixed(1) + ' s' : 'N/A';
+      EL.collapseReason.textContent = metrics.collapse_reason || 'N/A';
+
+      EL.packetsSent.textContent = success;
+      EL.packetsFailed.textContent = failed;
+      EL.volume.textContent = metrics.data_volume_mb.toFixed(3);
+      EL.avgMsgsDevice.textContent = metrics.avg_messages_per_device.toFixed(2);
+      EL.avgRateDevice.textContent = metrics.avg_send_rate_per_device.toFixed(3);
+
+      EL.successRate.textContent = successRate >= 0 ? successRate.toFixed(2) + '%' : '--';
+      EL.failedDevicesSecondary.textContent = metrics.failed_devices;
+      EL.disconnectEvents.textContent = disconnectEvents;
+      EL.latencyMps.textContent = metrics.messages_per_second.toFixed(3);
+      EL.latencyBw.textContent = bandwidth.toFixed(4);
+
+      EL.latencyAvg.textContent = metrics.avg_latency_ms > 0 ? metrics.avg_latency_ms.toFixed(3) : '--';
+      EL.latencyP50.textContent = metrics.p50_latency_ms > 0 ? metrics.p50_latency_ms.toFixed(3) : '--';
+      EL.latencyP95.textContent = metrics.p95_latency_ms > 0 ? metrics.p95_latency_ms.toFixed(3) : '--';
+      EL.latencyP99.textContent = metrics.p99_latency_ms > 0 ? metrics.p99_latency_ms.toFixed(3) : '--';
+
+      updateTable(EL.disconnectTable, disconnectCauses);
+      updateDeviceTable(data.devices);
+      pushChartPoint(messagesChart, metrics.messages_per_second);
       pushChartPoint(bandwidthChart, bandwidth);
       pushLatencyPoint(latencyChart, metrics);
     }
 
-    function updateTable(tableId, data, headers) {
-      const table = document.getElementById(tableId);
-      while (table.rows.length > 1) table.deleteRow(1);
-      const entries = Array.isArray(data) ? data : Object.entries(data);
-      entries.forEach(entry => {
-        const [key, value] = Array.isArray(entry) ? entry : [entry.device, entry.messages];
-        const tr = table.insertRow();
-        tr.insertCell().innerText = key;
-        tr.insertCell().innerText = value;
-      });
+    // Rows are built off-document and swapped into the tbody in a single mutation.
+    // `columns` holds one array per table column, all of the same length.
+    function fillTableBody(table, columns) {
+      const frag = document.createDocumentFragment();
+      const rowCount = columns.length ? columns[0].length : 0;
+      for (let i = 0; i < rowCount; i++) {
+        const tr = document.createElement('tr');
+        for (let c = 0; c < columns.length; c++) {
+          const td = document.createElement('td');
+          td.textContent = columns[c][i];
+          tr.appendChild(td);
+        }
+        frag.appendChild(tr);
+      }
+      table.tBodies[0].replaceChildren(frag);
+    }
+
+    function updateTable(table, data) {
+      fillTableBody(table, [Object.keys(data), Object.values(data)]);
     }
 
     function updateDeviceTable(devices) {
-      const table = document.getElementById('devices-table');
-      while (table.rows.length > 1) table.deleteRow(1);
-      devices.slice(0, 10).forEach(item => {
-        const tr = table.insertRow();
-        tr.insertCell().innerText = item.device;
-        tr.insertCell().innerText = item.messages;
-        tr.insertCell().innerText = item.failed_messages;
+      fillTableBody(EL.devicesTable, [devices.device, devices.messages, devices.failed_messages]);
+    }
+
+    function pushPoints(chart, values) {
+      const x = Date.now();
+      chart.data.datasets.forEach((dataset, index) => {
+        dataset.data.push({ x, y: values[index] });
+        if (dataset.data.length > maxPoints) dataset.data.splice(0, dataset.data.length - maxPoints);
       });
+      chart.update('none');
     }
 
     function pushChartPoint(chart, value) {
-      const ts = new Date().toLocaleTimeString();
-      chart.data.labels.push(ts);
-      chart.data.datasets[0].data.push(value);
-      if (chart.data.labels.length > maxPoints) {
-        chart.data.labels.shift();
-        chart.data.datasets[0].data.shift();
-      }
-      chart.update();
+      pushPoints(chart, [value]);
     }
 
     function pushLatencyPoint(chart, metrics) {
-      const ts = new Date().toLocaleTimeString();
-      chart.data.labels.push(ts);
-      chart.data.datasets[0].data.push(metrics.avg_latency_ms ?? 0);
-      chart.data.datasets[1].data.push(metrics.p95_latency_ms ?? 0);
-      chart.data.datasets[2].data.push(metrics.p99_latency_ms ?? 0);
-      if (chart.data.labels.length > maxPoints) {
-        chart.data.labels.shift();
-        chart.data.datasets.forEach(dataset => dataset.data.shift());
-      }
-      chart.update();
+      pushPoints(chart, [metrics.avg_latency_ms, metrics.p95_latency_ms, metrics.p99_latency_ms]);
     }
 
     function formatSeconds(seconds) {
@@ -281,14 +304,82 @@ DASHBOARD_TEMPLATE = """
       return [h, m, s].map(v => String(v).padStart(2, '0')).join(':');
     }
 
-    fetchMetrics();
-    setInterval(fetchMetrics, refreshInterval);
+    async function loadHistory() {
+      try {
+        // About one sample per device pixel; decimation handles anything denser.
+        const points = Math.max(60, messagesCtx.canvas.width);
+        const response = await fetch(`/api/metrics/history?n=${points}`);
+        if (!response.ok) return;
+        const history = await response.json();
+        const toPoints = (times, values) => times.map((t, i) => ({ x: t * 1000, y: values[i] }));
+        messagesChart.data.datasets[0].data = toPoints(history.messages_per_second.t, history.messages_per_second.y);
+        bandwidthChart.data.datasets[0].data = toPoints(history.bandwidth_mbps.t, history.bandwidth_mbps.y);
+        const latency = history.latency;
+        latencyChart.data.datasets[0].data = toPoints(latency.t, latency.avg);
+        latencyChart.data.datasets[1].data = toPoints(latency.t, latency.p95);
+        latencyChart.data.datasets[2].data = toPoints(latency.t, latency.p99);
+        [messagesChart, bandwidthChart, latencyChart].forEach(chart => chart.update('none'));
+      } catch (err) {
+        console.error('History fetch failed:', err);
+      }
+    }
+
+    loadHistory().then(fetchMetrics);
+    if (window.EventSource) {
+      // The server pushes a new snapshot whenever the metrics change.
+      const source = new EventSource('/api/metrics/stream');
+      source.onmessage = event => updateDashboard(JSON.parse(event.data));
+    } else {
+      setInterval(fetchMetrics, refreshInterval);
+    }
   </script>
 </body>
 </html>
 """
 
 
+EMPTY_SUMMARY: dict[str, Any] = {
+    "timestamp": None,
+    "uptime_seconds": 0.0,
+    "elapsed_seconds": 0.0,
+    "total_devices": 0,
+    "active_clients": 0,
+    "connected_devices": 0,
+    "peak_connected_devices": 0,
+    "failed_devices": 0,
+    "successful_publishes": 0,
+    "failed_publishes": 0,
+    "avg_latency_ms": None,
+    "p50_latency_ms": None,
+    "p95_latency_ms": None,
+    "p99_latency_ms": None,
+    "messages_per_second": 0.0,
+    "bandwidth_mbps": 0.0,
+    "avg_send_rate_per_device": 0.0,
+    "avg_messages_per_device": 0.0,
+    "channels_in_use": 0,
+    "bytes_sent": 0,
+    "data_volume_mb": 0.0,
+    "collapse_time_seconds": None,
+    "collapse_reason": None,
+    "disconnect_causes": {},
+}
+
+# The dashboard gets every summary field, always with the same type: nullable
+# numbers become 0 (or -1 for "no collapse", since 0 s is a real collapse time),
+# so the page's chart and table code never sees a field flip between null and number.
+DASHBOARD_DEFAULTS: dict[str, Any] = dict(
+    EMPTY_SUMMARY,
+    timestamp="",
+    avg_latency_ms=0.0,
+    p50_latency_ms=0.0,
+    p95_latency_ms=0.0,
+    p99_latency_ms=0.0,
+    collapse_time_seconds=-1.0,
+    collapse_reason="",
+)
+
+
 class GlobalMetricsCollector:
     """Collector that merges metrics snapshots from múltiples shards."""
 
@@ -296,6 +387,28 @@ class GlobalMetricsCollector:
         self._lock = threading.Lock()
         self._snapshots: dict[str, dict[str, Any]] = {}
         self._devices_by_shard: dict[str, dict[str, dict[str, Any]]] = {}
+        # Bumped on every ingest; the summary only changes when a shard reports.
+        self.version = 0
+        self._changed = threading.Condition(self._lock)
+
+    def wait_for_change(
+        self, version: int, timeout: float, cancel: Optional[threading.Event] = None
+    ) -> int:
+        """Block until ``version`` is outdated, ``cancel`` is set or ``timeout`` expires.
+
+        Returns the current version. Whoever sets ``cancel`` must call ``wake_all``.
+        """
+        with self._changed:
+            self._changed.wait_for(
+                lambda: self.version != version or (cancel is not None and cancel.is_set()),
+                timeout,
+            )
+            return self.version
+
+    def wake_all(self) -> None:
+        """Wake every ``wait_for_change`` so waiters can recheck their cancel event."""
+        with self._changed:
+            self._changed.notify_all()
 
     def ingest(self, shard_id: str, snapshot: dict[str, Any], devices: list[dict[str, Any]]) -> None:
         shard_key = shard_id or "default"
@@ -313,6 +426,8 @@ class GlobalMetricsCollector:
                     "bytes": int(item.get("bytes", 0)),
                 }
             self._devices_by_shard[shard_key] = device_map
+            self.version += 1
+            self._changed.notify_all()
 
     def summary(self) -> dict[str, Any]:
         with self._lock:
@@ -434,58 +549,94 @@ class GlobalMetricsCollector:
             }
 
     def _empty_summary(self) -> dict[str, Any]:
-        return {
-            "timestamp": None,
-            "uptime_seconds": 0.0,
-            "elapsed_seconds": 0.0,
-            "total_devices": 0,
-            "active_clients": 0,
-            "connected_devices": 0,
-            "peak_connected_devices": 0,
-            "failed_devices": 0,
-            "successful_publishes": 0,
-            "failed_publishes": 0,
-            "avg_latency_ms": None,
-            "p50_latency_ms": None,
-            "p95_latency_ms": None,
-            "p99_latency_ms": None,
-            "messages_per_second": 0.0,
-            "bandwidth_mbps": 0.0,
-            "avg_send_rate_per_device": 0.0,
-            "avg_messages_per_device": 0.0,
-            "channels_in_use": 0,
-            "bytes_sent": 0,
-            "data_volume_mb": 0.0,
-            "collapse_time_seconds": None,
-            "collapse_reason": None,
-            "disconnect_causes": {},
-        }
+        return dict(EMPTY_SUMMARY, disconnect_causes={})
 
     def device_breakdown(self, limit: Optional[int] = None) -> list[dict[str, Any]]:
         with self._lock:
             aggregated: dict[str, dict[str, Any]] = {}
             for shard_stats in self._devices_by_shard.values():
                 for device, stats in shard_stats.items():
-                    total_entry = aggregated.setdefault(
-                        device,
-                        {
-                            "device": device,
-                            "messages": 0,
-                            "failed_messages": 0,
-                            "bytes": 0,
-                        },
-                    )
-                    total_entry["messages"] += stats.get("messages", 0)
-                    total_entry["failed_messages"] += stats.get("failed_messages", 0)
-                    total_entry["bytes"] += stats.get("bytes", 0)
-            devices = sorted(
+                    # ingest() stores every entry with all four keys, so the first
+                    # shard's entry is copied as-is instead of merged into defaults.
+                    total_entry = aggregated.get(device)
+                    if total_entry is None:
+                        aggregated[device] = dict(stats)
+                        continue
+                    total_entry["messages"] += stats["messages"]
+                    total_entry["failed_messages"] += stats["failed_messages"]
+                    total_entry["bytes"] += stats["bytes"]
+            if limit is not None:
+                return heapq.nlargest(limit, aggregated.values(), key=lambda item: item["messages"])
+            return sorted(
                 aggregated.values(),
                 key=lambda item: item["messages"],
                 reverse=True,
             )
-            if limit is not None:
-                devices = devices[:limit]
-            return devices
+
+
+def encode_json(data: Any) -> bytes:
+    if orjson is None:
+        return json.dumps(data, ensure_ascii=False).encode("utf-8")
+    return orjson.dumps(data)
+
+
+def lttb(xs: Sequence[float], ys: Sequence[float], threshold: int) -> list[int]:
+    """Largest-Triangle-Three-Buckets: indices of ``threshold`` points that keep the curve's shape.
+
+    The first and last points are always kept; every bucket in between keeps
+    the point forming the largest triangle with the previous pick and the
+    average of the next bucket.
+    """
+    size = len(xs)
+    if threshold >= size or threshold < 3:
+        return list(range(size))
+    picked = [0]
+    every = (size - 2) / (threshold - 2)
+    anchor = 0
+    for bucket in range(threshold - 2):
+        avg_start = int((bucket + 1) * every) + 1
+        avg_end = min(int((bucket + 2) * every) + 1, size)
+        span = avg_end - avg_start
+        avg_x = sum(xs[avg_start:avg_end]) / span
+        avg_y = sum(ys[avg_start:avg_end]) / span
+        ax = xs[anchor]
+        ay = ys[anchor]
+        best = -1.0
+        best_index = int(bucket * every) + 1
+        for index in range(best_index, int((bucket + 1) * every) + 1):
+            area = abs((ax - avg_x) * (ys[index] - ay) - (ax - xs[index]) * (avg_y - ay))
+            if area > best:
+                best = area
+                best_index = index
+        picked.append(best_index)
+        anchor = best_index
+    picked.append(size - 1)
+    return picked
+
+
+def accepted_encoding(preferred: tuple[str, ...], available: Any = None) -> Optional[str]:
+    """First encoding in ``preferred`` that the client accepts (and, if given, is ``available``)."""
+    accepted = request.accept_encodings
+    for encoding in preferred:
+        if accepted[encoding] > 0 and (available is None or encoding in available):
+            return encoding
+    return None
+
+
+def parse_json_body() -> Any:
+    if orjson is None:
+        return request.get_json(force=True)
+    try:
+        return orjson.loads(request.get_data())
+    except orjson.JSONDecodeError as exc:
+        raise BadRequest(f"Invalid JSON body: {exc}") from exc
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """Request handler without the per-request access log line; errors are still logged."""
+
+    def log_request(self, code: Any = "-", size: Any = "-") -> None:
+        pass
 
 
 class MetricsServer:
@@ -508,8 +659,135 @@ class MetricsServer:
         self._app = Flask(__name__)
         self._server = None
         self._thread: Optional[threading.Thread] = None
+        self._cache_lock = threading.Lock()
+        self._cached_version: Optional[int] = None
+        self._cached_blob = b""
+        self._cached_gzip: Optional[bytes] = None
+        # Versions restart at 0 with every server, so ETags carry a per-instance prefix.
+        self._etag_prefix = secrets.token_hex(4)
+        self._stopping = threading.Event()
+        # (epoch seconds, messages/s, Mbps, avg, p95, p99 latency ms) per refresh interval.
+        self._history: deque[tuple[float, float, float, float, float, float]] = deque(
+            maxlen=HISTORY_LIMIT
+        )
+        self._sampler: Optional[threading.Thread] = None
         self._setup_routes()
 
+    def metrics_blob(self) -> tuple[bytes, Optional[str]]:
+        """Encoded /api/metrics body and its ETag, reused while the collector's version is unchanged.
+
+        Collectors without a ``version`` attribute (the local aggregator, whose
+        rates move with the clock) are encoded on every request and get no ETag.
+        """
+        version = getattr(self.collector, "version", None)
+        if version is None:
+            return self._encode_metrics(), None
+        etag = f"{self._etag_prefix}-{version:x}"
+        with self._cache_lock:
+            if version == self._cached_version:
+                return self._cached_blob, etag
+        blob = self._encode_metrics()
+        with self._cache_lock:
+            self._cached_version = version
+            self._cached_blob = blob
+            self._cached_gzip = None
+        return blob, etag
+
+    def metrics_gzip(self, blob: bytes) -> bytes:
+        """Gzip ``blob``, compressing a cached body only once per collector version."""
+        with self._cache_lock:
+            if blob is self._cached_blob and self._cached_gzip is not None:
+                return self._cached_gzip
+        compressed = gzip.compress(blob, compresslevel=6)
+        with self._cache_lock:
+            if blob is self._cached_blob:
+                self._cached_gzip = compressed
+        return compressed
+
+    def stream_events(self) -> Iterator[bytes]:
+        """Server-sent events with the /api/metrics body, pushed when it changes.
+
+        Versioned collectors wake the stream as soon as a shard reports; others
+        are sampled every refresh interval. Idle streams get a keep-alive comment
+        so closed browser tabs are noticed.
+        """
+        wait_for_change = getattr(self.collector, "wait_for_change", None)
+        refresh = max(self.refresh_interval_ms / 1000.0, 0.1)
+        last_etag: Optional[str] = None
+        while not self._stopping.is_set():
+            # Read before encoding so a report that lands meanwhile still wakes the wait.
+            version = getattr(self.collector, "version", None)
+            blob, etag = self.metrics_blob()
+            if etag is None or etag != last_etag:
+                last_etag = etag
+                yield b"data: " + blob + b"\n\n"
+            else:
+                yield b": keep-alive\n\n"
+            if wait_for_change is not None and version is not None:
+                wait_for_change(version, SSE_KEEPALIVE_SECONDS, self._stopping)
+            else:
+                self._stopping.wait(refresh)
+
+    def _sample_history(self) -> None:
+        refresh = max(self.refresh_interval_ms / 1000.0, 0.1)
+        while True:
+            snapshot = self.collector.summary()
+            self._history.append(
+                (
+                    time.time(),
+                    float(snapshot.get("messages_per_second") or 0.0),
+                    float(snapshot.get("bandwidth_mbps") or 0.0),
+                    float(snapshot.get("avg_latency_ms") or 0.0),
+                    float(snapshot.get("p95_latency_ms") or 0.0),
+                    float(snapshot.get("p99_latency_ms") or 0.0),
+                )
+            )
+            if self._stopping.wait(refresh):
+                return
+
+    def history(self, points: int) -> dict[str, Any]:
+        """Chart series downsampled with LTTB to at most ``points`` samples each.
+
+        The latency chart shares one x axis, so its three series reuse the
+        indices picked for P99.
+        """
+        samples = list(self._history)
+        ts = [sample[0] for sample in samples]
+        result: dict[str, Any] = {}
+        for key, column in (("messages_per_second", 1), ("bandwidth_mbps", 2)):
+            values = [sample[column] for sample in samples]
+            picked = lttb(ts, values, points)
+            result[key] = {"t": [ts[i] for i in picked], "y": [values[i] for i in picked]}
+        p99 = [sample[5] for sample in samples]
+        picked = lttb(ts, p99, points)
+        result["latency"] = {
+            "t": [ts[i] for i in picked],
+            "avg": [samples[i][3] for i in picked],
+            "p95": [samples[i][4] for i in picked],
+            "p99": [p99[i] for i in picked],
+        }
+        return result
+
+    def _encode_metrics(self) -> bytes:
+        summary = self.collector.summary()
+        snapshot = {}
+        for key, default in DASHBOARD_DEFAULTS.items():
+            value = summary.get(key)
+            snapshot[key] = default if value is None else value
+        # Column-oriented so the key names are not repeated for every row. Collectors
+        # that offer device_columns() build the columns without per-device dicts.
+        device_columns = getattr(self.collector, "device_columns", None)
+        if device_columns is not None:
+            devices = device_columns(DASHBOARD_DEVICE_LIMIT)
+        else:
+            top = self.collector.device_breakdown(limit=DASHBOARD_DEVICE_LIMIT)
+            devices = {
+                "device": [item["device"] for item in top],
+                "messages": [item["messages"] for item in top],
+                "failed_messages": [item["failed_messages"] for item in top],
+            }
+        return encode_json({"metrics": snapshot, "devices": devices})
+
     def _setup_routes(self) -> None:
         app = self._app
         collector = self.collector
@@ -517,25 +795,65 @@ class MetricsServer:
         profile_id = self.profile_id
         port = self.port
 
-        @app.route("/")
-        def dashboard() -> str:
-            return render_template_string(
+        # Every template value is fixed at construction, so the page is rendered once.
+        with app.app_context():
+            page = render_template_string(
                 DASHBOARD_TEMPLATE,
                 refresh_interval=refresh_interval,
                 port=port,
                 profile_id=profile_id,
-            )
+            ).encode("utf-8")
+        page_variants = {"gzip": gzip.compress(page, compresslevel=9)}
+        if brotli is not None:
+            page_variants["br"] = brotli.compress(page, quality=11)
+
+        @app.route("/")
+        def dashboard() -> Any:
+            encoding = accepted_encoding(("br", "gzip"), page_variants)
+            response = Response(page_variants.get(encoding, page), mimetype="text/html")
+            if encoding:
+                response.headers["Content-Encoding"] = encoding
+            response.vary.add("Accept-Encoding")
+            return response
 
         @app.get("/api/metrics")
         def metrics() -> Any:
-            snapshot = collector.summary()
-            devices = collector.device_breakdown(limit=None)
-            return jsonify({"metrics": snapshot, "devices": devices})
+            blob, etag = self.metrics_blob()
+            encoding = None
+            if len(blob) >= GZIP_MIN_BYTES:
+                encoding = accepted_encoding(("gzip",))
+            response = Response(
+                self.metrics_gzip(blob) if encoding else blob, mimetype="application/json"
+            )
+            if encoding:
+                response.headers["Content-Encoding"] = encoding
+            response.vary.add("Accept-Encoding")
+            if etag is None:
+                return response
+            # The browser revalidates every poll and gets 304 while no shard has reported.
+            # Weak, since the gzip and identity bodies share one validator.
+            response.set_etag(etag, weak=True)
+            response.headers["Cache-Control"] = "no-cache"
+            return response.make_conditional(request)
+
+        @app.get("/api/metrics/history")
+        def metrics_history() -> Any:
+            points = request.args.get("n", default=60, type=int)
+            points = max(3, min(points, HISTORY_MAX_POINTS))
+            return Response(encode_json(self.history(points)), mimetype="application/json")
+
+        @app.get("/api/metrics/stream")
+        def metrics_stream() -> Any:
+            return Response(
+                self.stream_events(),
+                mimetype="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
 
         if hasattr(collector, "ingest"):
             @app.post("/api/shard")
             def ingest() -> Any:
-                payload = request.get_json(force=True) or {}
+                payload = parse_json_body() or {}
                 shard_id = str(payload.get("shard_id", "unknown"))
                 snapshot = payload.get("snapshot") or {}
                 devices = payload.get("devices") or []
@@ -545,14 +863,33 @@ class MetricsServer:
     def start(self) -> None:
         if self._thread and self._thread.is_alive():
             return
-        self._server = make_server(self.host, self.port, self._app)
+        self._stopping.clear()
+        # Threaded so open event streams do not block page loads or shard pushes; a
+        # fixed-size pool (waitress, gunicorn sync workers) would be pinned by them.
+        self._server = make_server(
+            self.host,
+            self.port,
+            self._app,
+            threaded=True,
+            request_handler=QuietRequestHandler,
+        )
         self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
         self._thread.start()
+        self._sampler = threading.Thread(target=self._sample_history, daemon=True)
+        self._sampler.start()
 
     def stop(self) -> None:
+        self._stopping.set()
+        # Open event streams block on the collector, not on _stopping.
+        wake_all = getattr(self.collector, "wake_all", None)
+        if wake_all is not None:
+            wake_all()
         if self._server is not None:
             self._server.shutdown()
         if self._thread is not None:
             self._thread.join(timeout=5)
+        if self._sampler is not None:
+            self._sampler.join(timeout=5)
         self._server = None
         self._thread = None
+        self._sampler = None
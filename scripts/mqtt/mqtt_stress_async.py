@@ -6,6 +6,7 @@ import argparse
 import asyncio
 import contextlib
 import csv
+import heapq
 import io
 import json
 import math
@@ -16,11 +17,11 @@ import subprocess
 import sys
 import threading
 import time
-from collections import Counter, defaultdict
+from array import array
+from collections import Counter
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from pathlib import Path
-from statistics import fmean
 from time import perf_counter
 from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
 
@@ -32,6 +33,22 @@ from dotenv import load_dotenv
 
 from metrics_server import MetricsServer, GlobalMetricsCollector
 
+try:
+    import orjson
+except ImportError:  # orjson es opcional; se usa json de la libreria estandar.
+    orjson = None  # type: ignore[assignment]
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:  # inotify_simple es opcional (solo Linux); sin el se consulta stat periodicamente.
+    INotify = None  # type: ignore[assignment,misc]
+    inotify_flags = None  # type: ignore[assignment]
+
+try:
+    import msgpack
+except ImportError:  # msgpack es opcional; solo se usa con archivos .msgpack.
+    msgpack = None  # type: ignore[assignment]
+
 try:
     import matplotlib
 
@@ -51,6 +68,8 @@ METRICS_DIR = DATA_DIR / "metrics"
 REPORTS_DIR = METRICS_DIR / "reports"
 CONTROL_DIR = DATA_DIR / "control"
 DEFAULT_TOPIC = "v1/devices/me/telemetry"
+PAYLOAD_STATUSES = ("idle", "active", "maintenance")
+JSON_HEADERS = {"Content-Type": "application/json"}
 DEFAULT_DISABLED_FILE = CONTROL_DIR / "disabled_devices.json"
 DEFAULT_PID_FILE = CONTROL_DIR / "mqtt_stress.pid"
 
@@ -90,39 +109,118 @@ class DeviceToggleRegistry:
 
     def __init__(self, path: Path, refresh_interval: float = 2.0) -> None:
         self.path = path
+        self.log_path = path.with_suffix(".log")
         self.refresh_interval = max(refresh_interval, 0.5)
         self._disabled: Set[str] = set()
         self._last_loaded = 0.0
-        self._last_mtime: Optional[float] = None
+        self._last_key: Optional[Tuple[Optional[float], Optional[Tuple[float, int]]]] = None
         self._last_error: Optional[str] = None
+        self._watching = False
+        self._dirty = True
+        self._failed = False
+
+    def start_watching(self) -> bool:
+        """Usa inotify para recargar solo cuando cambian los archivos de control.
+
+        Devuelve False si inotify no esta disponible; entonces se sigue consultando
+        stat cada ``refresh_interval`` segundos.
+        """
+        if INotify is None or self._watching:
+            return self._watching
+        mask = (
+            inotify_flags.CREATE
+            | inotify_flags.MODIFY
+            | inotify_flags.CLOSE_WRITE
+            | inotify_flags.MOVED_TO
+            | inotify_flags.MOVED_FROM
+            | inotify_flags.DELETE
+        )
+        try:
+            inotify = INotify()
+            inotify.add_watch(self.path.parent, mask)
+        except OSError:
+            return False
+        names = {self.path.name, self.log_path.name}
+
+        def _watch() -> None:
+            while True:
+                for event in inotify.read():
+                    if event.name in names:
+                        self._dirty = True
+
+        threading.Thread(target=_watch, daemon=True, name="toggle-watch").start()
+        self._watching = True
+        return True
 
     def _should_refresh(self) -> bool:
+        if self._watching:
+            # Tras una lectura fallida se reintenta al ritmo de refresh_interval,
+            # aunque inotify no haya vuelto a avisar.
+            if self._failed:
+                return time.monotonic() - self._last_loaded >= self.refresh_interval
+            return self._dirty
         return time.monotonic() - self._last_loaded >= self.refresh_interval
 
-    def _load(self) -> None:
+    def _state_key(self) -> Tuple[Optional[float], Optional[Tuple[float, int]]]:
         try:
-            stat = self.path.stat()
+            snapshot_mtime: Optional[float] = self.path.stat().st_mtime
         except FileNotFoundError:
-            self._disabled.clear()
-            self._last_mtime = None
-            self._last_loaded = time.monotonic()
-            self._last_error = None
-            return
-        if self._last_mtime is not None and stat.st_mtime == self._last_mtime:
+            snapshot_mtime = None
+        try:
+            log_stat = self.log_path.stat()
+            log_key: Optional[Tuple[float, int]] = (log_stat.st_mtime, log_stat.st_size)
+        except FileNotFoundError:
+            log_key = None
+        return snapshot_mtime, log_key
+
+    def _load(self) -> None:
+        # Se limpia antes de leer para no perder un cambio que llegue durante la carga.
+        self._dirty = False
+        key = self._state_key()
+        if key == self._last_key:
             self._last_loaded = time.monotonic()
+            self._failed = False
             return
         try:
-            data = json.loads(self.path.read_text(encoding="utf-8"))
-            if isinstance(data, dict):
-                disabled_raw = data.get("disabled", [])
-            elif isinstance(data, list):
-                disabled_raw = data
-            else:
-                disabled_raw = []
-            self._disabled = {str(item) for item in disabled_raw}
-            self._last_mtime = stat.st_mtime
+            disabled: Set[str] = set()
+            if key[0] is not None:
+                if self.path.suffix == ".msgpack":
+                    if msgpack is None:
+                        raise RuntimeError("instala el paquete 'msgpack' para leer archivos .msgpack")
+                    data = msgpack.unpackb(self.path.read_bytes(), raw=False)
+                else:
+                    data = json.loads(self.path.read_text(encoding="utf-8"))
+                if isinstance(data, dict):
+                    disabled_raw = data.get("disabled", [])
+                elif isinstance(data, list):
+                    disabled_raw = data
+                else:
+                    disabled_raw = []
+                disabled = {str(item) for item in disabled_raw}
+            if key[1] is not None:
+                # toggle_devices.py agrega cambios a un log JSONL y lo consolida de vez en cuando.
+                with self.log_path.open(encoding="utf-8") as handle:
+                    for line in handle:
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue
+                        name = str(entry.get("name", ""))
+                        if not name:
+                            continue
+                        if entry.get("action") == "enable":
+                            disabled.discard(name)
+                        else:
+                            disabled.add(name)
+            self._disabled = disabled
+            self._last_key = key
             self._last_error = None
+            self._failed = False
+        except FileNotFoundError:
+            # Compactado entre el stat y la lectura; se reintenta en el siguiente ciclo.
+            self._dirty = self._failed = True
         except Exception as exc:  # noqa: BLE001
+            self._dirty = self._failed = True
             message = str(exc)
             if message != self._last_error:
                 print(f"[WARN] No se pudo leer {self.path}: {exc}", file=sys.stderr)
@@ -163,32 +261,45 @@ class DeviceToken:
 
 
 class MetricsAggregator:
-    def __init__(self, total_devices: int) -> None:
+    def __init__(self, total_devices: int, thread_safe: bool = True) -> None:
         self.total_devices = total_devices
-        self._lock = threading.Lock()
+        # Sin dashboard en el proceso solo lo usan tareas del event loop, que nunca se
+        # intercalan dentro de un metodo sincrono; en ese caso el candado sobra.
+        self._lock: Any = threading.Lock() if thread_safe else contextlib.nullcontext()
         self.started_at = utcnow()
         self.success_count = 0
         self.failure_count = 0
         self._latencies: List[float] = []
-        self._latencies_sorted = True
+        self._latency_total = 0.0
+        # Copia ordenada que crece en su sitio; _latencies_merged cuenta las muestras ya incluidas.
         self._latencies_cache: List[float] = []
+        self._latencies_merged = 0
         self._active_devices: set[str] = set()
         self._seen_devices: set[str] = set()
         self._failed_devices: set[str] = set()
-        self._messages_per_device: defaultdict[str, int] = defaultdict(int)
-        self._failed_messages_per_device: defaultdict[str, int] = defaultdict(int)
-        self._bytes_per_device: defaultdict[str, int] = defaultdict(int)
+        # Per-device counters as array('q', [messages, bytes, failed_messages]).
+        self._per_device: Dict[str, array] = {}
         self.disconnect_causes: Counter[str] = Counter()
         self.bytes_sent = 0
         self.peak_connected = 0
         self.collapsed_at: Optional[datetime] = None
         self.collapse_reason: Optional[str] = None
+        # device -> (messages, failed, bytes, fila JSON); solo lo usa el reporter periodico.
+        self._encoded_rows: Dict[str, Tuple[int, int, int, bytes]] = {}
 
     def _mark_collapse(self, reason: str) -> None:
         if self.collapsed_at is None:
             self.collapsed_at = utcnow()
             self.collapse_reason = reason
 
+    def _device_row(self, device_id: str) -> array:
+        # Caller must hold the lock.
+        row = self._per_device.get(device_id)
+        if row is None:
+            row = array("q", [0, 0, 0])
+            self._per_device[device_id] = row
+        return row
+
     def record_client_connected(self, device_id: str) -> None:
         with self._lock:
             self._active_devices.add(device_id)
@@ -210,19 +321,23 @@ class MetricsAggregator:
         latency_seconds: float,
         payload_bytes: int,
     ) -> None:
+        # Hot path: the row lookup is inlined instead of going through _device_row().
+        row = self._per_device.get(device_id)
         with self._lock:
+            if row is None:
+                row = self._device_row(device_id)
             self.success_count += 1
             self._latencies.append(latency_seconds)
-            self._latencies_sorted = False
+            self._latency_total += latency_seconds
             self.bytes_sent += payload_bytes
-            self._messages_per_device[device_id] += 1
-            self._bytes_per_device[device_id] += payload_bytes
+            row[0] += 1
+            row[1] += payload_bytes
 
     def record_publish_failure(self, device_id: str, reason: Optional[str]) -> None:
         with self._lock:
             self.failure_count += 1
             self._failed_devices.add(device_id)
-            self._failed_messages_per_device[device_id] += 1
+            self._device_row(device_id)[2] += 1
             if reason:
                 self.disconnect_causes[reason] += 1
             self._mark_collapse(reason or "publish failure")
@@ -237,11 +352,12 @@ class MetricsAggregator:
 
     def _ensure_sorted_latencies(self) -> Sequence[float]:
         # Caller must hold the lock.
-        if not self._latencies:
-            return []
-        if not self._latencies_sorted:
-            self._latencies_cache = sorted(self._latencies)
-            self._latencies_sorted = True
+        pending = len(self._latencies) - self._latencies_merged
+        if pending:
+            # Timsort aprovecha el prefijo ya ordenado: solo se acomoda la cola nueva.
+            self._latencies_cache.extend(self._latencies[self._latencies_merged :])
+            self._latencies_cache.sort()
+            self._latencies_merged += pending
         return self._latencies_cache
 
     def _percentile(self, percent: float, data: Sequence[float]) -> Optional[float]:
@@ -262,8 +378,12 @@ class MetricsAggregator:
         now = utcnow()
         with self._lock:
             elapsed = max((now - self.started_at).total_seconds(), 1e-9)
-            latencies_sorted = list(self._ensure_sorted_latencies())
-            avg_ms = round(fmean(self._latencies) * 1000, 4) if self._latencies else None
+            latencies_sorted = self._ensure_sorted_latencies()
+            avg_ms = (
+                round(self._latency_total / len(self._latencies) * 1000, 4)
+                if self._latencies
+                else None
+            )
             p50_ms = (
                 round(self._percentile(50, latencies_sorted) * 1000, 4)
                 if latencies_sorted
@@ -324,26 +444,90 @@ class MetricsAggregator:
         return snap
 
     def device_breakdown(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        empty = array("q", [0, 0, 0])
+        with self._lock:
+            rows = list(self._per_device.items())
+            rows.extend(
+                (device, empty) for device in self._failed_devices if device not in self._per_device
+            )
+        # Con limite basta un heap acotado; el orden completo solo si se piden todos.
+        if limit is None:
+            rows.sort(key=lambda item: item[1][0], reverse=True)
+        else:
+            rows = heapq.nlargest(limit, rows, key=lambda item: item[1][0])
+        return [
+            {
+                "device": device,
+                "messages": row[0],
+                "failed_messages": row[2],
+                "bytes": row[1],
+            }
+            for device, row in rows
+        ]
+
+    def device_columns(self, limit: int) -> Dict[str, List[Any]]:
+        """Los ``limit`` dispositivos con mas mensajes como columnas paralelas."""
+        empty = array("q", [0, 0, 0])
         with self._lock:
-            devices: List[Dict[str, Any]] = []
-            all_devices = set(self._messages_per_device.keys()) | set(
-                self._failed_messages_per_device.keys()
-            ) | set(
-                self._failed_devices
+            rows = list(self._per_device.items())
+            rows.extend(
+                (device, empty) for device in self._failed_devices if device not in self._per_device
             )
-            for device in all_devices:
-                devices.append(
+        top = heapq.nlargest(limit, rows, key=lambda item: item[1][0])
+        return {
+            "device": [device for device, _row in top],
+            "messages": [row[0] for _device, row in top],
+            "failed_messages": [row[2] for _device, row in top],
+        }
+
+    def encoded_devices(self) -> bytes:
+        """device_breakdown() completo como arreglo JSON, para enviarlo al agregador.
+
+        Cada fila se codifica una sola vez mientras sus contadores no cambien, asi
+        los dispositivos inactivos no generan diccionarios nuevos en cada reporte.
+        """
+        empty = array("q", [0, 0, 0])
+        with self._lock:
+            rows = list(self._per_device.items())
+            rows.extend(
+                (device, empty) for device in self._failed_devices if device not in self._per_device
+            )
+        cache = self._encoded_rows
+        parts: List[bytes] = []
+        for device, row in rows:
+            messages, sent_bytes, failed = row
+            cached = cache.get(device)
+            if (
+                cached is None
+                or cached[0] != messages
+                or cached[1] != failed
+                or cached[2] != sent_bytes
+            ):
+                encoded = json_bytes(
                     {
                         "device": device,
-                        "messages": self._messages_per_device.get(device, 0),
-                        "failed_messages": self._failed_messages_per_device.get(device, 0),
-                        "bytes": self._bytes_per_device.get(device, 0),
+                        "messages": messages,
+                        "failed_messages": failed,
+                        "bytes": sent_bytes,
                     }
                 )
-            devices.sort(key=lambda item: item["messages"], reverse=True)
-            if limit is not None:
-                devices = devices[:limit]
-            return devices
+                cache[device] = (messages, failed, sent_bytes, encoded)
+            else:
+                encoded = cached[3]
+            parts.append(encoded)
+        return b"[" + b",".join(parts) + b"]"
+
+
+def json_bytes(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+
+def json_line(record: Dict[str, Any]) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
 
 
 class AsyncJsonLogger:
@@ -356,13 +540,24 @@ class AsyncJsonLogger:
         self._task = asyncio.create_task(self._writer())
 
     async def _writer(self) -> None:
-        async with aiofiles.open(self.path, "w", encoding="utf-8") as afp:
+        async with aiofiles.open(self.path, "wb") as afp:
             while True:
-                record = await self._queue.get()
-                if record is None:
+                # Todo lo que ya esta en cola sale en una sola escritura y un solo flush.
+                records = [await self._queue.get()]
+                while not self._queue.empty():
+                    records.append(self._queue.get_nowait())
+                lines: List[bytes] = []
+                closing = False
+                for record in records:
+                    if record is None:
+                        closing = True
+                        break
+                    lines.append(json_line(record))
+                if lines:
+                    await afp.write(b"".join(lines))
+                    await afp.flush()
+                if closing:
                     break
-                await afp.write(json.dumps(record, ensure_ascii=False) + "\n")
-                await afp.flush()
 
     async def log(self, record: Dict[str, Any]) -> None:
         await self._queue.put(record)
@@ -597,6 +792,7 @@ class AggregatorClient:
     def __init__(self, endpoint: str, shard_id: str) -> None:
         self.endpoint = endpoint
         self.shard_id = shard_id
+        self._shard_json = json_bytes(shard_id)
         self._session: Optional[aiohttp.ClientSession] = None
         self._lock = asyncio.Lock()
 
@@ -611,17 +807,26 @@ class AggregatorClient:
                 await self._session.close()
                 self._session = None
 
-    async def send(self, snapshot: Dict[str, Any], devices: List[Dict[str, Any]]) -> None:
+    async def send(self, snapshot: Dict[str, Any], devices: bytes) -> None:
+        """Envia el snapshot y las filas ya codificadas por MetricsAggregator.encoded_devices()."""
         async with self._lock:
             if self._session is None:
                 return
-            payload = {
-                "shard_id": self.shard_id,
-                "snapshot": snapshot,
-                "devices": devices,
-            }
+            body = b"".join(
+                (
+                    b'{"shard_id":',
+                    self._shard_json,
+                    b',"snapshot":',
+                    json_bytes(snapshot),
+                    b',"devices":',
+                    devices,
+                    b"}",
+                )
+            )
             try:
-                async with self._session.post(self.endpoint, json=payload, timeout=5):
+                async with self._session.post(
+                    self.endpoint, data=body, headers=JSON_HEADERS, timeout=5
+                ):
                     pass
             except Exception as exc:  # noqa: BLE001
                 print(f"[WARN] No se pudo reportar m├®tricas al agregador ({exc}).", file=sys.stderr)
@@ -698,19 +903,22 @@ class DeviceWorker:
             "temperature": round(random.uniform(18.0, 32.0), 2),
             "humidity": round(random.uniform(30.0, 70.0), 2),
             "voltage": round(random.uniform(210.0, 230.0), 2),
-            "status": random.choice(["idle", "active", "maintenance"]),
+            "status": random.choice(PAYLOAD_STATUSES),
             "device_id": self.config.device_id,
         }
 
     async def _publish(self, client: Client) -> bool:
         payload_dict = self._build_payload()
-        payload_json = json.dumps(payload_dict, ensure_ascii=False)
+        # Se serializa una sola vez a bytes; su longitud es el tamano enviado.
+        if orjson is not None:
+            payload_bytes = orjson.dumps(payload_dict)
+        else:
+            payload_bytes = json.dumps(payload_dict, ensure_ascii=False).encode("utf-8")
         start = perf_counter()
         try:
-            await client.publish(self.topic, payload_json, qos=self.qos)
+            await client.publish(self.topic, payload_bytes, qos=self.qos)
             latency = perf_counter() - start
-            payload_size = len(payload_json.encode("utf-8"))
-            self.metrics.record_publish_success(self.config.device_id, latency, payload_size)
+            self.metrics.record_publish_success(self.config.device_id, latency, len(payload_bytes))
             await self.event_logger.log(
                 {
                     "timestamp": utcnow().isoformat(),
@@ -856,9 +1064,11 @@ class DeviceWorker:
 
 
 def load_tokens_from_file(path: Path) -> List[DeviceToken]:
-    if not path.exists():
-        raise FileNotFoundError(f"No se encontr├│ el archivo de tokens: {path}")
-    data = json.loads(path.read_text(encoding="utf-8"))
+    try:
+        raw = path.read_bytes()
+    except FileNotFoundError:
+        raise FileNotFoundError(f"No se encontr├│ el archivo de tokens: {path}") from None
+    data = orjson.loads(raw) if orjson is not None else json.loads(raw)
     tokens: List[DeviceToken] = []
     if isinstance(data, dict):
         for device_id, token in sorted(data.items()):
@@ -1008,8 +1218,7 @@ async def periodic_reporter(
             snapshot = metrics.snapshot()
             await csv_logger.log(snapshot)
             if aggregator_client is not None:
-                devices = metrics.device_breakdown(limit=None)
-                await aggregator_client.send(snapshot, devices)
+                await aggregator_client.send(snapshot, metrics.encoded_devices())
             print(
                 (
                     f"[{snapshot['timestamp']}] activos={snapshot['active_clients']}/"
@@ -1027,8 +1236,7 @@ async def periodic_reporter(
     snapshot = metrics.snapshot()
     await csv_logger.log(snapshot)
     if aggregator_client is not None:
-        devices = metrics.device_breakdown(limit=None)
-        await aggregator_client.send(snapshot, devices)
+        await aggregator_client.send(snapshot, metrics.encoded_devices())
     print(
         (
             f"[{snapshot['timestamp']}] resumen final -> ok={snapshot['successful_publishes']}, "
@@ -1064,6 +1272,7 @@ async def run_simulation(args: argparse.Namespace) -> None:
     else:
         ramp_sequence = parse_ramp(ramp_counts_input, total_devices=len(selected_devices))
     toggle_registry = DeviceToggleRegistry(args.disabled_devices_file)
+    toggle_registry.start_watching()
     disabled_now = toggle_registry.current_disabled()
     if disabled_now:
         sorted_names = sorted(disabled_now)
@@ -1075,7 +1284,8 @@ async def run_simulation(args: argparse.Namespace) -> None:
             f"[INFO] {len(sorted_names)} dispositivo(s) deshabilitado(s) manualmente: {preview}",
             file=sys.stderr,
         )
-    metrics = MetricsAggregator(total_devices=len(selected_devices))
+    serve_dashboard = not args.disable_dashboard and args.aggregator_endpoint is None
+    metrics = MetricsAggregator(total_devices=len(selected_devices), thread_safe=serve_dashboard)
     session_id_base = utcnow().strftime("async-run-%Y%m%d-%H%M%S")
     shard_suffix = ""
     if getattr(args, "worker", False):
@@ -1116,7 +1326,7 @@ async def run_simulation(args: argparse.Namespace) -> None:
         await aggregator_client.start()
 
     metrics_server: Optional[MetricsServer] = None
-    if not args.disable_dashboard and args.aggregator_endpoint is None:
+    if serve_dashboard:
         try:
             metrics_server = MetricsServer(
                 metrics,
@@ -2,26 +2,113 @@
 """Render a summary of the most recent telemetry simulation run."""
 from __future__ import annotations
 
+import bisect
 import json
+import sys
 from collections import Counter
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Any, BinaryIO, Dict, Iterator, List, NoReturn, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stdlib parser.
+    orjson = None  # type: ignore[assignment]
+
+try:
+    import ijson
+except ImportError:  # ijson is optional; without it the whole file is parsed at once.
+    ijson = None  # type: ignore[assignment]
 
 ROOT = Path(__file__).resolve().parents[2]
 RUNS_DIR = ROOT / "data" / "runs"
 LATEST_FILE = RUNS_DIR / "latest.json"
+TABLE_LIMIT = 20
+
+_DEPTH_STEP = {"start_map": 1, "start_array": 1, "end_map": -1, "end_array": -1}
+
+
+def missing_summary() -> NoReturn:
+    print("No existe data/runs/latest.json. Ejecuta scripts/send_telemetry.py primero.")
+    raise SystemExit(1)
 
 
 def load_summary() -> Dict:
-    if not LATEST_FILE.exists():
-        print("No existe data/runs/latest.json. Ejecuta scripts/send_telemetry.py primero.")
-        raise SystemExit(1)
-    return json.loads(LATEST_FILE.read_text(encoding="utf-8"))
+    # latest.json is replaced atomically; opening it directly avoids an extra stat
+    # and the window between exists() and the read.
+    try:
+        raw = LATEST_FILE.read_bytes()
+    except FileNotFoundError:
+        missing_summary()
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+
+def _stream_summary(handle: BinaryIO) -> Iterator[Tuple[str, str, Any]]:
+    """Walk ijson events, building one top-level field or one device at a time."""
+    depth = 0
+    key: Optional[str] = None
+    device: Optional[str] = None
+    builder = None
+    level = 0
+    kind, name = "field", ""
+    for _prefix, event, value in ijson.parse(handle, use_float=True):
+        if builder is not None:
+            builder.event(event, value)
+            depth += _DEPTH_STEP.get(event, 0)
+            if depth == level:
+                yield kind, name, builder.value
+                builder = None
+            continue
+        if event == "map_key":
+            if depth == 1:
+                key = value
+            else:
+                device = value
+            continue
+        if event == "start_map" and (depth == 0 or (depth == 1 and key == "devices")):
+            depth += 1
+            continue
+        if event in ("end_map", "end_array"):
+            depth -= 1
+            continue
+        level = depth
+        kind, name = ("device", device) if depth == 2 else ("field", key)
+        if event in ("start_map", "start_array"):
+            builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+            depth += 1
+        else:
+            yield kind, name, value
+
+
+def iter_summary() -> Iterator[Tuple[str, str, Any]]:
+    """Yield ``("field", key, value)`` for top-level entries and ``("device", name, metrics)``.
+
+    With ijson installed the file is streamed, so only one device is held in
+    memory at a time; otherwise the whole summary is parsed up front.
+    """
+    if ijson is None:
+        for key, value in load_summary().items():
+            if key == "devices":
+                for device, metrics in value.items():
+                    yield "device", device, metrics
+            else:
+                yield "field", key, value
+        return
+    try:
+        handle = LATEST_FILE.open("rb")
+    except FileNotFoundError:
+        missing_summary()
+    with handle:
+        yield from _stream_summary(handle)
 
 
 def format_duration(seconds: float) -> str:
-    mins, sec = divmod(int(seconds), 60)
-    hrs, mins = divmod(mins, 60)
+    total = int(seconds)
+    if 0 <= total < 60:
+        return f"{total}s"
+    hrs = total // 3600
+    mins = total % 3600 // 60
+    sec = total % 60
     if hrs:
         return f"{hrs}h {mins}m {sec}s"
     if mins:
@@ -33,69 +120,80 @@ def top_items(counter: Counter, limit: int = 5) -> List[Tuple[str, int]]:
     return counter.most_common(limit)
 
 
-def main() -> int:
-    summary = load_summary()
-
-    print("=" * 70)
-    print("TELEMETRY SESSION SUMMARY")
-    print("=" * 70)
-    print(f"Session: {summary.get('session_id')}")
-    print(f"Started: {summary.get('started_at')}")
-    print(f"Ended  : {summary.get('ended_at')}")
-    print(f"Duration: {format_duration(summary.get('duration_seconds', 0.0))}")
+def flush_output(out: List[str]) -> None:
+    sys.stdout.writelines(out)
+    sys.stdout.flush()
+    out.clear()
+
+
+def render_session(summary: Dict, out: List[str]) -> None:
+    emit = out.append
+    emit("=" * 70 + "\n")
+    emit("TELEMETRY SESSION SUMMARY\n")
+    emit("=" * 70 + "\n")
+    emit(f"Session: {summary.get('session_id')}\n")
+    emit(f"Started: {summary.get('started_at')}\n")
+    emit(f"Ended  : {summary.get('ended_at')}\n")
+    emit(f"Duration: {format_duration(summary.get('duration_seconds', 0.0))}\n")
     mqtt_info = summary.get("mqtt", {})
-    print(
+    emit(
         f"MQTT: {mqtt_info.get('host')}:{mqtt_info.get('port')} "
-        f"(TLS={'on' if mqtt_info.get('tls') else 'off'})"
+        f"(TLS={'on' if mqtt_info.get('tls') else 'off'})\n"
     )
-    print(f"Interval: {summary.get('interval_seconds')}s")
-    print(f"Devices: {summary.get('device_count')} | Messages: {summary.get('messages_sent')}")
-    print(f"Log file: {summary.get('log_file')}")
-    print()
-
-    metrics = summary.get("metrics", {})
-    if metrics:
-        print("Global metrics:")
-        connected_current = metrics.get("connected_devices", 0)
-        connected_peak = metrics.get("peak_connected_devices", 0)
-        print(f"  - Connected (current/peak): {connected_current}/{connected_peak}")
-        channels_in_use = metrics.get("channels_in_use", connected_current)
-        print(f"  - Channels in use: {channels_in_use}")
-        failed_devices = metrics.get("failed_devices", 0)
-        total_devices = metrics.get("total_devices", 0)
-        print(f"  - Failed devices: {failed_devices} of {total_devices}")
-        packets_sent = metrics.get("messages_sent", 0)
-        packets_failed = metrics.get("messages_failed", 0)
-        print(f"  - Packets sent/failed: {packets_sent} / {packets_failed}")
-        data_volume_mb = float(metrics.get("data_volume_mb", 0.0))
-        bytes_sent = metrics.get("bytes_sent", 0)
-        print(f"  - Data volume: {data_volume_mb:.2f} MB ({bytes_sent} bytes)")
-        bandwidth_mbps = float(metrics.get("bandwidth_mbps", 0.0))
-        print(f"  - Bandwidth: {bandwidth_mbps:.3f} Mbps")
-        msgs_per_second = float(metrics.get("messages_per_second", 0.0))
-        print(f"  - Messages per second: {msgs_per_second:.3f}")
-        avg_messages = float(metrics.get("avg_messages_per_device", 0.0))
-        print(f"  - Average messages per device: {avg_messages:.2f}")
-        avg_rate = float(metrics.get("avg_send_rate_per_device", 0.0))
-        print(f"  - Average send rate per device: {avg_rate:.3f} msg/s")
-        collapse_secs = metrics.get("collapse_time_seconds")
-        collapse_reason = metrics.get("collapse_reason")
-        if collapse_secs is not None:
-            reason_label = f" due to {collapse_reason}" if collapse_reason else ""
-            print(f"  - Collapse after: {collapse_secs:.1f}s{reason_label}")
-        else:
-            print("  - Collapse: not detected")
-        disconnect_causes = metrics.get("disconnect_causes") or {}
-        if disconnect_causes:
-            print("  - Disconnect causes:")
-            for reason, count in disconnect_causes.items():
-                print(f"      * {reason}: {count}")
-        print()
-
-    device_data: Dict[str, Dict] = summary.get("devices", {})
-    if not device_data:
-        print("No per-device metrics found.")
-        return 0
+    emit(f"Interval: {summary.get('interval_seconds')}s\n")
+    emit(f"Devices: {summary.get('device_count')} | Messages: {summary.get('messages_sent')}\n")
+    emit(f"Log file: {summary.get('log_file')}\n")
+    emit("\n")
+
+
+def render_metrics(metrics: Dict, out: List[str]) -> None:
+    if not metrics:
+        return
+    emit = out.append
+    emit("Global metrics:\n")
+    connected_current = metrics.get("connected_devices", 0)
+    connected_peak = metrics.get("peak_connected_devices", 0)
+    emit(f"  - Connected (current/peak): {connected_current}/{connected_peak}\n")
+    channels_in_use = metrics.get("channels_in_use", connected_current)
+    emit(f"  - Channels in use: {channels_in_use}\n")
+    failed_devices = metrics.get("failed_devices", 0)
+    total_devices = metrics.get("total_devices", 0)
+    emit(f"  - Failed devices: {failed_devices} of {total_devices}\n")
+    packets_sent = metrics.get("messages_sent", 0)
+    packets_failed = metrics.get("messages_failed", 0)
+    emit(f"  - Packets sent/failed: {packets_sent} / {packets_failed}\n")
+    data_volume_mb = float(metrics.get("data_volume_mb", 0.0))
+    bytes_sent = metrics.get("bytes_sent", 0)
+    emit(f"  - Data volume: {data_volume_mb:.2f} MB ({bytes_sent} bytes)\n")
+    bandwidth_mbps = float(metrics.get("bandwidth_mbps", 0.0))
+    emit(f"  - Bandwidth: {bandwidth_mbps:.3f} Mbps\n")
+    msgs_per_second = float(metrics.get("messages_per_second", 0.0))
+    emit(f"  - Messages per second: {msgs_per_second:.3f}\n")
+    avg_messages = float(metrics.get("avg_messages_per_device", 0.0))
+    emit(f"  - Average messages per device: {avg_messages:.2f}\n")
+    avg_rate = float(metrics.get("avg_send_rate_per_device", 0.0))
+    emit(f"  - Average send rate per device: {avg_rate:.3f} msg/s\n")
+    collapse_secs = metrics.get("collapse_time_seconds")
+    collapse_reason = metrics.get("collapse_reason")
+    if collapse_secs is not None:
+        reason_label = f" due to {collapse_reason}" if collapse_reason else ""
+        emit(f"  - Collapse after: {collapse_secs:.1f}s{reason_label}\n")
+    else:
+        emit("  - Collapse: not detected\n")
+    disconnect_causes = metrics.get("disconnect_causes") or {}
+    if disconnect_causes:
+        emit("  - Disconnect causes:\n")
+        for reason, count in disconnect_causes.items():
+            emit(f"      * {reason}: {count}\n")
+    emit("\n")
+
+
+def main() -> int:
+    # The report is assembled in memory and written in as few calls as possible.
+    out: List[str] = []
+    emit = out.append
+    summary: Dict[str, Any] = {}
+    session_printed = False
 
     issues_counter: Counter = Counter()
     error_counter: Counter = Counter()
@@ -103,64 +201,88 @@ def main() -> int:
     delayed_start: List[str] = []
     stalled_devices: List[str] = []
 
-    for device, metrics in device_data.items():
+    # First TABLE_LIMIT devices by name as (device, messages, disconnects, errors).
+    table: List[Tuple[str, int, int, int]] = []
+    device_total = 0
+
+    for kind, key, value in iter_summary():
+        if kind == "field":
+            summary[key] = value
+            continue
+        if not session_printed:
+            # Every session field precedes "devices" in the run summary.
+            render_session(summary, out)
+            flush_output(out)
+            session_printed = True
+        device, metrics = key, value
+        device_total += 1
+        first_publish_at = metrics.get("first_publish_at")
+        last_publish_at = metrics.get("last_publish_at")
+        connected_at = metrics.get("connected_at")
+        errors = metrics.get("errors") or ()
+        disconnects = metrics.get("disconnects") or ()
+        if len(table) < TABLE_LIMIT or device < table[-1][0]:
+            bisect.insort(table, (device, metrics.get("messages_sent", 0), len(disconnects), len(errors)))
+            del table[TABLE_LIMIT:]
         issues = metrics.get("last_issue")
         if issues:
             issues_counter[issues] += 1
-        errors = metrics.get("errors", [])
         if errors:
             error_counter[device] = len(errors)
-        if not metrics.get("first_publish_at"):
+        if not first_publish_at or first_publish_at == last_publish_at:
             stalled_devices.append(device)
-        elif metrics.get("first_publish_at") == metrics.get("last_publish_at"):
-            stalled_devices.append(device)
-        connected_at = metrics.get("connected_at")
-        first_publish_at = metrics.get("first_publish_at")
         if connected_at and first_publish_at and connected_at != first_publish_at:
             delayed_start.append(device)
 
+    if not session_printed:
+        render_session(summary, out)
+    render_metrics(summary.get("metrics", {}), out)
+
+    if not device_total:
+        emit("No per-device metrics found.\n")
+        flush_output(out)
+        return 0
+
     if issues_counter:
-        print("Last reported issues (top 5):")
+        emit("Last reported issues (top 5):\n")
         for issue, count in top_items(issues_counter):
-            print(f"  - {issue}: {count} devices")
-        print()
+            emit(f"  - {issue}: {count} devices\n")
+        emit("\n")
 
     if error_counter:
-        print("Devices with recorded errors:")
+        emit("Devices with recorded errors:\n")
         for device, count in error_counter.most_common():
-            print(f"  - {device}: {count} error events")
-        print()
+            emit(f"  - {device}: {count} error events\n")
+        emit("\n")
 
     if stalled_devices:
-        print("Devices with stalled publishing (no telemetry or only one message):")
+        emit("Devices with stalled publishing (no telemetry or only one message):\n")
         for device in stalled_devices:
-            print(f"  - {device}")
-        print()
+            emit(f"  - {device}\n")
+        emit("\n")
 
     if delayed_start:
-        print("Devices with delayed first publish after connection:")
+        emit("Devices with delayed first publish after connection:\n")
         for device in delayed_start:
-            print(f"  - {device}")
-        print()
-
-    print("Per-device totals (subset):")
-    print(f"{'Device':<15}{'Messages':>10}{'Disconnects':>15}{'Errors':>10}")
-    print("-" * 50)
-    for device, metrics in sorted(device_data.items())[:20]:
-        disconnects = len(metrics.get("disconnects", []))
-        errors = len(metrics.get("errors", []))
-        messages = metrics.get("messages_sent", 0)
-        print(f"{device:<15}{messages:>10}{disconnects:>15}{errors:>10}")
-
-    remaining = len(device_data) - min(20, len(device_data))
+            emit(f"  - {device}\n")
+        emit("\n")
+
+    emit("Per-device totals (subset):\n")
+    emit(f"{'Device':<15}{'Messages':>10}{'Disconnects':>15}{'Errors':>10}\n")
+    emit("-" * 50 + "\n")
+    for device, messages, disconnects, errors in table:
+        emit(f"{device:<15}{messages:>10}{disconnects:>15}{errors:>10}\n")
+
+    remaining = device_total - len(table)
     if remaining > 0:
-        print(f"... ({remaining} dispositivos adicionales no listados)")
+        emit(f"... ({remaining} dispositivos adicionales no listados)\n")
 
-    print()
-    print("Consulta detallada:")
-    print(f"  - Reporte JSON completo: {summary.get('log_file', 'logs')} / data/runs/latest.json")
-    print("  - Para inspeccionar un dispositivo especifico, revisa la seccion 'devices'")
-    print()
+    emit("\n")
+    emit("Consulta detallada:\n")
+    emit(f"  - Reporte JSON completo: {summary.get('log_file', 'logs')} / data/runs/latest.json\n")
+    emit("  - Para inspeccionar un dispositivo especifico, revisa la seccion 'devices'\n")
+    emit("\n")
+    flush_output(out)
 
     return 0
 
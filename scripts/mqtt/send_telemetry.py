@@ -2,24 +2,41 @@
 """MQTT simulator with real-time metrics collection and dashboard."""
 from __future__ import annotations
 
+import functools
+import heapq
 import json
 import logging
 import os
 import random
+import selectors
 import signal
+import socket
+import ssl
 import threading
 import time
-from collections import Counter, defaultdict
+from array import array
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, List, Optional, Set
+from typing import Dict, List, Optional, Set, Tuple
 
 import paho.mqtt.client as mqtt
 from dotenv import load_dotenv
 
 from metrics_server import MetricsServer
 
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stdlib json module.
+    orjson = None  # type: ignore[assignment]
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; readings are then drawn one call at a time.
+    np = None  # type: ignore[assignment]
+
 load_dotenv(override=True)
 
 ROOT = Path(__file__).resolve().parents[2]
@@ -33,6 +50,34 @@ MQTT_HOST = os.getenv("MQTT_HOST", "127.0.0.1")
 MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
 MQTT_TLS = os.getenv("MQTT_TLS", "0") == "1"
 INTERVAL = float(os.getenv("PUBLISH_INTERVAL_SEC", "3"))
+ISSUES = ("network-latency", "sensor-drift", "low-battery", "high-cpu", "memory-pressure")
+NET_THREADS = int(os.getenv("MQTT_NET_THREADS", "32"))
+# Linux only: pin each long-lived thread to one CPU and run the reporters at lower priority.
+PIN_THREADS = os.getenv("MQTT_PIN_THREADS", "0") == "1"
+QOS = int(os.getenv("MQTT_QOS", "1"))
+MAX_INFLIGHT = int(os.getenv("MQTT_MAX_INFLIGHT", "1000"))
+# Kernel send buffer per MQTT socket in bytes; 0 keeps the system default.
+SOCKET_SNDBUF = int(os.getenv("MQTT_SNDBUF", str(1 << 20)))
+# Readings sent per MQTT message; above 1 they go out as a [{"ts", "values"}] array.
+PUBLISH_BATCH = max(1, int(os.getenv("PUBLISH_BATCH", "1")))
+TELEMETRY_TOPIC = "v1/devices/me/telemetry"
+# Gateway mode: with a gateway token, batches of devices share one connection.
+GATEWAY_TOKEN = os.getenv("MQTT_GATEWAY_TOKEN", "")
+GATEWAY_BATCH = max(1, int(os.getenv("MQTT_GATEWAY_BATCH", "100")))
+GATEWAY_TELEMETRY_TOPIC = "v1/gateway/telemetry"
+GATEWAY_CONNECT_TOPIC = "v1/gateway/connect"
+# Payload pieces that never change between ticks are formatted/encoded once here.
+PAYLOAD_FIELDS = (
+    '%d,"timestamp":"%s","temperature":%.2f,"humidity":%d,"battery":%.2f,'
+    '"cpu_usage_percent":%.2f,"memory_usage_mb":%.1f,"network_latency_ms":%.1f,'
+)
+OK_TAIL = b'"status":"ok","issue":null}'
+# Readings drawn per numpy call; each SimLoop consumes one per tick.
+READING_BLOCK = 64
+ISSUE_TAILS = tuple(
+    f'"status":"{"critical" if issue == "low-battery" else "warn"}","issue":"{issue}"}}'.encode("utf-8")
+    for issue in ISSUES
+)
 
 
 def utcnow() -> datetime:
@@ -43,27 +88,47 @@ def iso(dt: Optional[datetime]) -> Optional[str]:
     return dt.isoformat() if dt else None
 
 
+_DISCONNECT_REASONS: Dict[int, str] = {
+    mqtt.MQTT_ERR_SUCCESS: "graceful shutdown",
+    mqtt.MQTT_ERR_CONN_LOST: "connection lost",
+    mqtt.MQTT_ERR_NO_CONN: "no connection to broker",
+    mqtt.MQTT_ERR_PROTOCOL: "protocol violation",
+    mqtt.MQTT_ERR_QUEUE_SIZE: "internal queue full",
+    mqtt.MQTT_ERR_TLS: "tls handshake failure",
+}
+
+_EXCEPTION_CATEGORIES: Dict[type, str] = {
+    ConnectionError: "network",
+    TimeoutError: "network",
+    socket.gaierror: "network",
+    MemoryError: "memory",
+}
+
+
+# Return codes and exception types form a tiny domain, so results are memoized;
+# a broker collapse then classifies thousands of failures without rebuilding strings.
+@functools.lru_cache(maxsize=256)
 def classify_disconnect(rc: int) -> str:
-    if rc == mqtt.MQTT_ERR_SUCCESS:
-        return "graceful shutdown"
-    mapping = {
-        mqtt.MQTT_ERR_CONN_LOST: "connection lost",
-        mqtt.MQTT_ERR_NO_CONN: "no connection to broker",
-        mqtt.MQTT_ERR_PROTOCOL: "protocol violation",
-        mqtt.MQTT_ERR_QUEUE_SIZE: "internal queue full",
-        mqtt.MQTT_ERR_TLS: "tls handshake failure",
-    }
-    return mapping.get(rc, mqtt.error_string(rc))
+    reason = _DISCONNECT_REASONS.get(rc)
+    return reason if reason is not None else mqtt.error_string(rc)
 
 
-def classify_exception(exc: BaseException) -> str:
-    import socket
+@functools.lru_cache(maxsize=256)
+def describe_error(rc: int) -> str:
+    return mqtt.error_string(rc)
+
+
+@functools.lru_cache(maxsize=256)
+def _exception_category(klass: type) -> str:
+    for base in klass.__mro__:
+        category = _EXCEPTION_CATEGORIES.get(base)
+        if category is not None:
+            return category
+    return klass.__name__
 
-    if isinstance(exc, (ConnectionError, TimeoutError, socket.gaierror)):
-        return "network"
-    if isinstance(exc, MemoryError):
-        return "memory"
-    return exc.__class__.__name__
+
+def classify_exception(exc: BaseException) -> str:
+    return _exception_category(type(exc))
 
 
 @dataclass
@@ -71,36 +136,76 @@ class TelemetryMetrics:
     messages_sent: int = 0
     first_publish_at: Optional[datetime] = None
     last_publish_at: Optional[datetime] = None
-    last_payload: Optional[Dict[str, object]] = None
+    last_payload: Optional[bytes] = None
     disconnects: List[Dict[str, object]] = field(default_factory=list)
     errors: List[Dict[str, object]] = field(default_factory=list)
     connected_at: Optional[datetime] = None
     last_issue: Optional[str] = None
 
 
+# Per-device counters are guarded by one of these locks, picked by device name.
+SHARD_COUNT = 32
+# SimLoops batch their sent counters and hand them to the collector after this many
+# publishes or seconds, whichever comes first.
+COUNTER_FLUSH_EVERY = 16
+COUNTER_FLUSH_SECONDS = 1.0
+# MetricsReporter's log line; MetricsCollector.headline() returns its arguments in order.
+METRICS_LOG_FORMAT = (
+    "Metrics | connected=%d failed=%d msgs=%d failed_msgs=%d "
+    "bandwidth=%.3fMbps avg_rate=%.3f msg/s"
+)
+
+
 class MetricsCollector:
     def __init__(self, total_devices: int):
         self.total_devices = total_devices
+        # Serializes writers of the connection sets, causes and collapse state.
+        # Readers skip it: they only take len() of the sets and read collapse,
+        # which is swapped as a whole tuple, so nothing can be seen half-written.
         self._lock = threading.Lock()
+        self._shard_locks = tuple(threading.Lock() for _ in range(SHARD_COUNT))
         self.started_at = utcnow()
         self.connected_now: Set[str] = set()
         self.seen_devices: Set[str] = set()
         self.failed_devices: Set[str] = set()
-        self.messages_sent = 0
-        self.messages_failed = 0
-        self.bytes_sent = 0
         self.peak_connected = 0
-        self.collapsed_at: Optional[datetime] = None
-        self.collapse_reason: Optional[str] = None
-        self.messages_per_device: Dict[str, int] = defaultdict(int)
-        self.bytes_per_device: Dict[str, int] = defaultdict(int)
-        self.failed_messages_per_device: Dict[str, int] = defaultdict(int)
+        # (collapsed_at, reason) once the run collapses; never mutated in place.
+        self.collapse: Optional[Tuple[datetime, str]] = None
+        # Per-device counters as array('q', [messages, bytes, failed_messages]).
+        # Run totals are summed from these rows, so publishes never take self._lock.
+        self.per_device: Dict[str, array] = {}
         self.disconnect_causes: Counter[str] = Counter()
+        # Publish failure causes, striped like the device rows and merged on read.
+        self._failure_causes = tuple(Counter() for _ in range(SHARD_COUNT))
 
     def _mark_collapse(self, reason: str) -> None:
-        if self.collapsed_at is None:
-            self.collapsed_at = utcnow()
-            self.collapse_reason = reason
+        if self.collapse is None:
+            self.collapse = (utcnow(), reason)
+
+    def _device_row(self, device: str) -> array:
+        row = self.per_device.get(device)
+        if row is None:
+            # setdefault is atomic, so concurrent first records share one row.
+            row = self.per_device.setdefault(device, array("q", [0, 0, 0]))
+        return row
+
+    def totals(self) -> Tuple[int, int, int]:
+        """Return (messages_sent, bytes_sent, messages_failed) summed over every device."""
+        sent = sent_bytes = failed = 0
+        for row in list(self.per_device.values()):
+            sent += row[0]
+            sent_bytes += row[1]
+            failed += row[2]
+        return sent, sent_bytes, failed
+
+    def cause_counts(self) -> Counter[str]:
+        """Connection and publish failure causes merged into one counter."""
+        with self._lock:
+            causes = Counter(self.disconnect_causes)
+        for lock, shard in zip(self._shard_locks, self._failure_causes):
+            with lock:
+                causes.update(shard)
+        return causes
 
     def record_connect(self, device: str) -> None:
         with self._lock:
@@ -117,21 +222,28 @@ class MetricsCollector:
                     self.disconnect_causes[reason] += 1
                 self._mark_collapse(reason or "disconnect")
 
-    def record_message_sent(self, device: str, payload_bytes: int) -> None:
-        with self._lock:
-            self.messages_sent += 1
-            self.bytes_sent += payload_bytes
-            self.messages_per_device[device] += 1
-            self.bytes_per_device[device] += payload_bytes
+    def record_message_sent(self, device: str, payload_bytes: int, count: int = 1) -> None:
+        # Hot path: only the device's shard is locked; the row lookup is inlined.
+        row = self.per_device.get(device)
+        if row is None:
+            row = self._device_row(device)
+        with self._shard_locks[hash(device) % SHARD_COUNT]:
+            row[0] += count
+            row[1] += payload_bytes
 
     def record_message_failed(self, device: str, reason: Optional[str]) -> None:
-        with self._lock:
-            self.messages_failed += 1
-            self.failed_devices.add(device)
-            self.failed_messages_per_device[device] += 1
+        shard = hash(device) % SHARD_COUNT
+        row = self._device_row(device)
+        with self._shard_locks[shard]:
+            row[2] += 1
             if reason:
-                self.disconnect_causes[reason] += 1
-            self._mark_collapse(reason or "publish failure")
+                self._failure_causes[shard][reason] += 1
+        # Once the device is marked failed and the run has collapsed there is
+        # nothing left to update under the global lock.
+        if device not in self.failed_devices or self.collapse is None:
+            with self._lock:
+                self.failed_devices.add(device)
+                self._mark_collapse(reason or "publish failure")
 
     def record_runtime_error(self, device: str, reason: str) -> None:
         with self._lock:
@@ -139,70 +251,90 @@ class MetricsCollector:
             self.disconnect_causes[reason] += 1
             self._mark_collapse(reason)
 
+    def headline(self) -> Tuple[int, int, int, int, float, float]:
+        """Values for METRICS_LOG_FORMAT, without the top lists and causes of snapshot()."""
+        now = utcnow()
+        messages_sent, bytes_sent, messages_failed = self.totals()
+        elapsed = max((now - self.started_at).total_seconds(), 1e-9)
+        observed_devices = max(len(self.seen_devices), self.total_devices, 1)
+        return (
+            len(self.connected_now),
+            len(self.failed_devices),
+            messages_sent,
+            messages_failed,
+            (bytes_sent * 8) / elapsed / 1_000_000,
+            messages_sent / elapsed / observed_devices,
+        )
+
     def snapshot(self) -> Dict[str, object]:
         now = utcnow()
-        with self._lock:
-            elapsed = max((now - self.started_at).total_seconds(), 1e-9)
-            observed_devices = max(len(self.seen_devices), self.total_devices, 1)
-            avg_rate = self.messages_sent / elapsed / observed_devices
-            avg_messages = self.messages_sent / observed_devices
-            messages_per_second = self.messages_sent / elapsed
-            bandwidth_mbps = (self.bytes_sent * 8) / elapsed / 1_000_000
-            collapse_seconds = (
-                (self.collapsed_at - self.started_at).total_seconds()
-                if self.collapsed_at
-                else None
-            )
-            top_senders = sorted(
-                self.messages_per_device.items(), key=lambda item: item[1], reverse=True
-            )[:10]
-            top_failures = sorted(
-                self.failed_messages_per_device.items(), key=lambda item: item[1], reverse=True
-            )[:10]
-            return {
-                "elapsed_seconds": elapsed,
-                "connected_devices": len(self.connected_now),
-                "failed_devices": len(self.failed_devices),
-                "messages_sent": self.messages_sent,
-                "messages_failed": self.messages_failed,
-                "data_volume_mb": self.bytes_sent / (1024 * 1024),
-                "avg_send_rate_per_device": avg_rate,
-                "avg_messages_per_device": avg_messages,
-                "messages_per_second": messages_per_second,
-                "bandwidth_mbps": bandwidth_mbps,
-                "channels_in_use": len(self.connected_now),
-                "collapse_time_seconds": collapse_seconds,
-                "collapse_reason": self.collapse_reason,
-                "top_senders": top_senders,
-                "top_failures": top_failures,
-                "disconnect_causes": dict(self.disconnect_causes.most_common(10)),
-            }
+        messages_sent, bytes_sent, messages_failed = self.totals()
+        rows = list(self.per_device.items())
+        causes = self.cause_counts()
+        # Only the top ten are reported, so a bounded heap replaces a full sort.
+        top_senders = heapq.nlargest(
+            10, ((device, row[0]) for device, row in rows if row[0]), key=lambda item: item[1]
+        )
+        top_failures = heapq.nlargest(
+            10, ((device, row[2]) for device, row in rows if row[2]), key=lambda item: item[1]
+        )
+        elapsed = max((now - self.started_at).total_seconds(), 1e-9)
+        observed_devices = max(len(self.seen_devices), self.total_devices, 1)
+        connected = len(self.connected_now)
+        collapse = self.collapse
+        return {
+            "elapsed_seconds": elapsed,
+            "connected_devices": connected,
+            "failed_devices": len(self.failed_devices),
+            "messages_sent": messages_sent,
+            "messages_failed": messages_failed,
+            "data_volume_mb": bytes_sent / (1024 * 1024),
+            "avg_send_rate_per_device": messages_sent / elapsed / observed_devices,
+            "avg_messages_per_device": messages_sent / observed_devices,
+            "messages_per_second": messages_sent / elapsed,
+            "bandwidth_mbps": (bytes_sent * 8) / elapsed / 1_000_000,
+            "channels_in_use": connected,
+            "collapse_time_seconds": (
+                (collapse[0] - self.started_at).total_seconds() if collapse else None
+            ),
+            "collapse_reason": collapse[1] if collapse else None,
+            "top_senders": top_senders,
+            "top_failures": top_failures,
+            "disconnect_causes": dict(causes.most_common(10)),
+        }
 
     def summary(self) -> Dict[str, object]:
         snap = self.snapshot()
-        with self._lock:
-            snap["total_devices"] = self.total_devices
-            snap["peak_connected_devices"] = self.peak_connected
-            snap["bytes_sent"] = self.bytes_sent
-            snap["disconnect_causes"] = dict(self.disconnect_causes)
+        snap["bytes_sent"] = self.totals()[1]
+        snap["disconnect_causes"] = dict(self.cause_counts())
+        snap["total_devices"] = self.total_devices
+        snap["peak_connected_devices"] = self.peak_connected
         return snap
 
     def device_breakdown(self, limit: Optional[int] = None) -> List[Dict[str, object]]:
-        with self._lock:
-            devices: List[Dict[str, object]] = []
-            for device, count in self.messages_per_device.items():
-                devices.append(
-                    {
-                        "device": device,
-                        "messages": count,
-                        "failed_messages": self.failed_messages_per_device.get(device, 0),
-                        "bytes": self.bytes_per_device.get(device, 0),
-                    }
-                )
-            devices.sort(key=lambda item: item["messages"], reverse=True)
-            if limit is not None:
-                devices = devices[:limit]
-            return devices
+        rows = list(self.per_device.items())
+        if limit is None:
+            rows.sort(key=lambda item: item[1][0], reverse=True)
+        else:
+            rows = heapq.nlargest(limit, rows, key=lambda item: item[1][0])
+        return [
+            {
+                "device": device,
+                "messages": row[0],
+                "failed_messages": row[2],
+                "bytes": row[1],
+            }
+            for device, row in rows
+        ]
+
+    def device_columns(self, limit: int) -> Dict[str, List[object]]:
+        """Top ``limit`` senders as parallel columns, without a dict per device."""
+        top = heapq.nlargest(limit, list(self.per_device.items()), key=lambda item: item[1][0])
+        return {
+            "device": [device for device, _row in top],
+            "messages": [row[0] for _device, row in top],
+            "failed_messages": [row[2] for _device, row in top],
+        }
 
 
 class MetricsReporter(threading.Thread):
@@ -216,26 +348,179 @@ class MetricsReporter(threading.Thread):
         self._stop_event.set()
 
     def run(self) -> None:
+        pin_current_thread(0, background=True)
         while not self._stop_event.wait(self.interval):
-            snapshot = self.collector.snapshot()
-            LOGGER.info(
-                (
-                    "Metrics | connected=%d failed=%d msgs=%d failed_msgs=%d "
-                    "bandwidth=%.3fMbps avg_rate=%.3f msg/s"
-                ),
-                snapshot["connected_devices"],
-                snapshot["failed_devices"],
-                snapshot["messages_sent"],
-                snapshot["messages_failed"],
-                snapshot["bandwidth_mbps"],
-                snapshot["avg_send_rate_per_device"],
-            )
+            LOGGER.info(METRICS_LOG_FORMAT, *self.collector.headline())
+
+
+class NetworkLoop(threading.Thread):
+    """Drives the socket I/O of many paho clients from a single thread.
+
+    The selector is only touched when paho reports a socket being opened or
+    closed, instead of being rescanned for every client on each pass.
+    """
+
+    def __init__(self, index: int, reconnect_delay: float = 1.0, misc_interval: float = 1.0):
+        super().__init__(daemon=True, name=f"mqtt-net-{index}")
+        self.index = index
+        self.reconnect_delay = reconnect_delay
+        self.misc_interval = misc_interval
+        self._selector = selectors.DefaultSelector()
+        self._clients: Dict[mqtt.Client, Optional[object]] = {}
+        # Socket changes reported by paho callbacks, applied by the loop thread.
+        self._pending: Dict[mqtt.Client, Optional[object]] = {}
+        self._last_reconnect: Dict[mqtt.Client, float] = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def register(self, client: mqtt.Client) -> None:
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        sock = client.socket()
+        if sock is not None:
+            tune_socket(sock)
+        with self._lock:
+            self._clients.setdefault(client, None)
+            # connect() already ran, so the first socket_open went unseen.
+            self._pending[client] = sock
+
+    def unregister(self, client: mqtt.Client) -> None:
+        with self._lock:
+            known = self._clients.pop(client, None)
+            self._pending.pop(client, None)
+            self._last_reconnect.pop(client, None)
+            if known is not None:
+                self._forget(known)
+        client.on_socket_open = None
+        client.on_socket_close = None
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def _on_socket_open(self, client, _userdata, sock) -> None:
+        tune_socket(sock)
+        with self._lock:
+            if client in self._clients:
+                self._pending[client] = sock
+
+    def _on_socket_close(self, client, _userdata, _sock) -> None:
+        with self._lock:
+            if client in self._clients:
+                self._pending[client] = None
+
+    def _forget(self, sock: object) -> None:
+        # Caller must hold the lock.
+        try:
+            self._selector.unregister(sock)
+        except (KeyError, ValueError, OSError):
+            pass
+
+    def _apply_pending(self) -> None:
+        with self._lock:
+            if not self._pending:
+                return
+            changes = list(self._pending.items())
+            self._pending.clear()
+            # Drop stale sockets first: a closed descriptor may be reused by another client.
+            for client, sock in changes:
+                known = self._clients.get(client)
+                if known is not None and known is not sock:
+                    self._forget(known)
+                    self._clients[client] = None
+            for client, sock in changes:
+                if sock is not None and self._clients.get(client) is None:
+                    self._selector.register(sock, selectors.EVENT_READ, client)
+                    self._clients[client] = sock
+
+    def _housekeeping(self, now: float) -> None:
+        with self._lock:
+            clients = list(self._clients.items())
+        for client, sock in clients:
+            if sock is None:
+                last = self._last_reconnect.get(client, 0.0)
+                if now - last >= self.reconnect_delay:
+                    self._last_reconnect[client] = now
+                    try:
+                        client.reconnect()
+                    except Exception:  # noqa: BLE001
+                        pass
+                continue
+            client.loop_misc()
+            # Publishes write inline; only a short write leaves data queued here.
+            if client.want_write():
+                client.loop_write()
+
+    def run(self) -> None:
+        # CPU 0 is left to the background threads and CPU 1 to the scheduler.
+        pin_current_thread(self.index + 2)
+        next_misc = time.monotonic()
+        while not self._stop_event.is_set():
+            self._apply_pending()
+            now = time.monotonic()
+            if now >= next_misc:
+                self._housekeeping(now)
+                next_misc = now + self.misc_interval
+                self._apply_pending()
+            if not self._selector.get_map():
+                self._stop_event.wait(0.1)
+                continue
+            try:
+                ready = self._selector.select(timeout=0.1)
+            except (OSError, ValueError):
+                # A socket was closed while waiting; its close callback resyncs the selector.
+                continue
+            for key, _events in ready:
+                key.data.loop_read()
+        self._selector.close()
+
+
+class ClientPool:
+    """Spreads paho clients over a fixed number of shared network threads."""
+
+    def __init__(self, size: int):
+        self.loops = [NetworkLoop(index) for index in range(max(1, size))]
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def assign(self) -> NetworkLoop:
+        with self._lock:
+            loop = self.loops[self._next % len(self.loops)]
+            self._next += 1
+        return loop
+
+    def start(self) -> None:
+        for loop in self.loops:
+            loop.start()
+
+    def stop(self) -> None:
+        for loop in self.loops:
+            loop.stop()
+        for loop in self.loops:
+            loop.join(timeout=5)
+
+
+class TimestampTicker(threading.Thread):
+    """Refreshes the shared payload timestamp so devices do not format their own."""
 
+    def __init__(self, interval: float):
+        super().__init__(daemon=True, name="timestamp-ticker")
+        self.interval = max(interval, 0.01)
+        self._stop_event = threading.Event()
 
-RUNNING = threading.Event()
-RUNNING.set()
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def run(self) -> None:
+        pin_current_thread(0, background=True)
+        while not self._stop_event.wait(self.interval):
+            CURRENT_TS[0] = iso(utcnow())
+
+
+# Set by the signal handlers; main() blocks on it instead of polling.
+STOPPED = threading.Event()
 LOGGER = logging.getLogger("tb_simulator")
-thread_barrier: Optional[threading.Barrier] = None
+# Single-element list so the ticker can swap the string atomically for every SimLoop.
+CURRENT_TS: List[str] = [iso(utcnow())]
 
 
 def setup_logging(session_id: str) -> Path:
@@ -257,22 +542,152 @@ def setup_logging(session_id: str) -> Path:
     return log_path
 
 
-class SimLoop(threading.Thread):
-    def __init__(self, name: str, token: str, session_id: str, collector: MetricsCollector):
-        super().__init__(daemon=True, name=f"sim-{name}")
+@functools.lru_cache(maxsize=None)
+def tls_context() -> ssl.SSLContext:
+    """Build the TLS context once; tls_set() would reload the CA bundle for every client."""
+    return ssl.create_default_context()
+
+
+def pin_current_thread(slot: int, background: bool = False) -> None:
+    """Pin the calling thread to CPU ``slot`` (modulo the CPUs this process may use).
+
+    ``background`` threads also get a higher nice value so they yield to the
+    publishing threads. No-op unless MQTT_PIN_THREADS=1 and the platform supports it.
+    """
+    if not PIN_THREADS or not hasattr(os, "sched_setaffinity"):
+        return
+    try:
+        cpus = sorted(os.sched_getaffinity(0))
+        os.sched_setaffinity(0, {cpus[slot % len(cpus)]})
+        if background:
+            # Linux applies nice values per thread when given its native id.
+            tid = threading.get_native_id()
+            os.setpriority(os.PRIO_PROCESS, tid, os.getpriority(os.PRIO_PROCESS, tid) + 5)
+    except OSError as exc:
+        LOGGER.debug("Could not pin %s: %s", threading.current_thread().name, exc)
+
+
+def tune_socket(sock) -> None:
+    """Disable Nagle so small telemetry packets are not held back, and enlarge the send buffer."""
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if SOCKET_SNDBUF > 0:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_SNDBUF)
+    except OSError as exc:
+        LOGGER.debug("Could not tune MQTT socket: %s", exc)
+
+
+def make_client(client_id: str, username: str) -> mqtt.Client:
+    client = mqtt.Client(client_id=client_id, clean_session=True)
+    client.username_pw_set(username)
+    if MQTT_TLS:
+        client.tls_set_context(tls_context())
+    client.max_inflight_messages_set(MAX_INFLIGHT)
+    client.max_queued_messages_set(0)
+    return client
+
+
+class GatewayLink:
+    """One ThingsBoard gateway connection that publishes on behalf of several SimLoops."""
+
+    def __init__(self, index: int, session_id: str, network: NetworkLoop):
+        self.name = f"gateway-{index:03d}"
+        self.network = network
+        self.members: List[SimLoop] = []
+        suffix = random.randint(1, 1_000_000)
+        self.client = make_client(f"{session_id}-{self.name}-{suffix}", GATEWAY_TOKEN)
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        self._connected = False
+        self._released = 0
+        self._error: Optional[BaseException] = None
+        self._lock = threading.Lock()
+
+    def on_connect(self, client, userdata, flags, rc) -> None:
+        if rc == 0:
+            # Announce every device again after each (re)connection.
+            for loop in self.members:
+                client.publish(GATEWAY_CONNECT_TOPIC, loop.gateway_connect_payload, qos=QOS)
+        for loop in self.members:
+            loop.on_connect(client, userdata, flags, rc)
+
+    def on_disconnect(self, client, userdata, rc) -> None:
+        for loop in self.members:
+            loop.on_disconnect(client, userdata, rc)
+
+    def connect(self) -> None:
+        # Called once per member; only the first call opens the connection.
+        with self._lock:
+            if self._error is not None:
+                raise self._error
+            if self._connected:
+                return
+            try:
+                self.client.connect(MQTT_HOST, MQTT_PORT, keepalive=60)
+                self.network.register(self.client)
+            except Exception as exc:  # noqa: BLE001
+                self._error = exc
+                raise
+            self._connected = True
+
+    def close(self) -> None:
+        # Called once per member; the shared connection stays up until the last one.
+        with self._lock:
+            self._released += 1
+            if self._released < len(self.members) or not self._connected:
+                return
+            self._connected = False
+        try:
+            self.network.unregister(self.client)
+            self.client.disconnect()
+        except Exception:  # noqa: BLE001
+            pass
+
+
+class SimLoop:
+    """One simulated device; publishing is driven by PublishScheduler."""
+
+    def __init__(
+        self,
+        name: str,
+        token: str,
+        session_id: str,
+        collector: MetricsCollector,
+        network: NetworkLoop,
+        link: Optional[GatewayLink] = None,
+    ):
         self.name = name
         self.token = token
         self.session_id = session_id
         self.collector = collector
-        suffix = random.randint(1, 1_000_000)
-        self.client = mqtt.Client(client_id=f"{session_id}-{name}-{suffix}", clean_session=True)
-        self.client.username_pw_set(self.token)
-        if MQTT_TLS:
-            self.client.tls_set()
-        self.client.on_connect = self.on_connect
-        self.client.on_disconnect = self.on_disconnect
+        self.network = network
+        self.link = link
+        # Each loop owns its generator so ticks do not share the module-level one.
+        self.rng = random.Random()
+        self._np_rng = np.random.default_rng() if np is not None else None
+        self._readings: List[Tuple[float, int, float, float, float, float, int]] = []
+        quoted = json.dumps(name)
+        if link is None:
+            suffix = self.rng.randint(1, 1_000_000)
+            self.client = make_client(f"{session_id}-{name}-{suffix}", self.token)
+            self.client.on_connect = self.on_connect
+            self.client.on_disconnect = self.on_disconnect
+            self.topic = TELEMETRY_TOPIC
+            self._envelope = (b"[", b"]") if PUBLISH_BATCH > 1 else (b"", b"")
+        else:
+            link.members.append(self)
+            self.client = link.client
+            self.topic = GATEWAY_TELEMETRY_TOPIC
+            self._envelope = (f"{{{quoted}:[".encode("utf-8"), b"]}")
+            self.gateway_connect_payload = f'{{"device":{quoted}}}'.encode("utf-8")
         self.metrics = TelemetryMetrics()
+        self._batch: List[bytes] = []
+        self._batch_last = b""
+        self._unflushed_messages = 0
+        self._unflushed_bytes = 0
+        self._flushed_at = time.monotonic()
         self._sequence = 0
+        self._payload_prefix = f'{{"device":{quoted},"sequence":'.encode("utf-8")
         self._lock = threading.Lock()
 
     def on_connect(self, _client, _userdata, _flags, rc) -> None:
@@ -309,74 +724,196 @@ class SimLoop(threading.Thread):
             self.collector.record_runtime_error(self.name, f"{stage}: {message}")
         LOGGER.warning("%s error: %s | %s", self.name, stage, message)
 
-    def payload(self) -> Dict[str, object]:
+    def payload(self) -> bytes:
+        # The device prefix is encoded once; only the variable tail is formatted here.
         self._sequence += 1
-        cpu_usage = round(random.uniform(18.0, 75.0), 2)
-        memory_usage = round(random.uniform(120.0, 350.0), 1)
-        latency_ms = round(random.uniform(15.0, 250.0), 1)
-        issue = None
-        status = "ok"
-        if random.random() < 0.05:
-            issue = random.choice(
-                ["network-latency", "sensor-drift", "low-battery", "high-cpu", "memory-pressure"]
+        if self._np_rng is not None:
+            if not self._readings:
+                self._draw_readings()
+            temperature, humidity, battery, cpu, memory, latency, issue = self._readings.pop()
+            tail = OK_TAIL if issue < 0 else ISSUE_TAILS[issue]
+        else:
+            rng = self.rng
+            uniform = rng.uniform
+            tail = OK_TAIL if rng.random() >= 0.05 else rng.choice(ISSUE_TAILS)
+            temperature = uniform(20.0, 30.0)
+            humidity = rng.randint(35, 65)
+            battery = uniform(3.4, 4.2)
+            cpu = uniform(18.0, 75.0)
+            memory = uniform(120.0, 350.0)
+            latency = uniform(15.0, 250.0)
+        fields = PAYLOAD_FIELDS % (
+            self._sequence,
+            CURRENT_TS[0],
+            temperature,
+            humidity,
+            battery,
+            cpu,
+            memory,
+            latency,
+        )
+        return self._payload_prefix + fields.encode("utf-8") + tail
+
+    def _draw_readings(self) -> None:
+        # One vectorized call per column covers the next READING_BLOCK ticks.
+        rng = self._np_rng
+        size = READING_BLOCK
+        issues = np.where(
+            rng.random(size) < 0.05, rng.integers(0, len(ISSUE_TAILS), size), -1
+        )
+        self._readings = list(
+            zip(
+                rng.uniform(20.0, 30.0, size).tolist(),
+                rng.integers(35, 66, size).tolist(),
+                rng.uniform(3.4, 4.2, size).tolist(),
+                rng.uniform(18.0, 75.0, size).tolist(),
+                rng.uniform(120.0, 350.0, size).tolist(),
+                rng.uniform(15.0, 250.0, size).tolist(),
+                issues.tolist(),
             )
-            status = "warn" if issue != "low-battery" else "critical"
-        return {
-            "timestamp": iso(utcnow()),
-            "device": self.name,
-            "sequence": self._sequence,
-            "temperature": round(random.uniform(20.0, 30.0), 2),
-            "humidity": random.randint(35, 65),
-            "battery": round(random.uniform(3.4, 4.2), 2),
-            "cpu_usage_percent": cpu_usage,
-            "memory_usage_mb": memory_usage,
-            "network_latency_ms": latency_ms,
-            "status": status,
-            "issue": issue,
-        }
+        )
 
-    def run(self) -> None:
+    def connect(self) -> bool:
         try:
-            self.client.connect(MQTT_HOST, MQTT_PORT, keepalive=60)
-            self.client.loop_start()
-            if thread_barrier is None:
-                raise RuntimeError("barrier not initialized")
-            thread_barrier.wait()
-            while RUNNING.is_set():
-                payload = self.payload()
-                payload_json = json.dumps(payload)
-                payload_bytes = len(payload_json.encode("utf-8"))
-                info = self.client.publish("v1/devices/me/telemetry", payload_json, qos=1)
-                if info.rc == mqtt.MQTT_ERR_SUCCESS:
-                    now = utcnow()
-                    with self._lock:
-                        self.metrics.messages_sent += 1
-                        self.metrics.last_payload = payload
-                        if not self.metrics.first_publish_at:
-                            self.metrics.first_publish_at = now
-                        self.metrics.last_publish_at = now
-                        self.metrics.last_issue = None
-                    self.collector.record_message_sent(self.name, payload_bytes)
-                else:
-                    reason = mqtt.error_string(info.rc)
-                    self.record_error("publish", reason, info.rc)
-                    self.collector.record_message_failed(self.name, reason)
-                time.sleep(INTERVAL)
+            if self.link is not None:
+                self.link.connect()
+            else:
+                self.client.connect(MQTT_HOST, MQTT_PORT, keepalive=60)
+                self.network.register(self.client)
         except Exception as exc:  # noqa: BLE001
             reason = classify_exception(exc)
             self.record_error("runtime", f"{reason}: {exc.__class__.__name__}")
-        finally:
-            try:
-                self.client.loop_stop()
-                self.client.disconnect()
-            except Exception:  # noqa: BLE001
-                pass
+            return False
+        return True
+
+    def tick(self) -> bool:
+        """Publishes one payload; returns False if the device must stop publishing."""
+        try:
+            payload = self.payload()
+            if PUBLISH_BATCH > 1:
+                # Each reading keeps its own ts so ThingsBoard stores all of them.
+                self._batch.append(b'{"ts":%d,"values":%s}' % (time.time_ns() // 1_000_000, payload))
+                self._batch_last = payload
+                if len(self._batch) < PUBLISH_BATCH:
+                    return True
+                self.publish_batch()
+            else:
+                self._publish(payload, 1, payload)
+        except Exception as exc:  # noqa: BLE001
+            reason = classify_exception(exc)
+            self.record_error("runtime", f"{reason}: {exc.__class__.__name__}")
+            return False
+        return True
+
+    def publish_batch(self) -> None:
+        """Publishes the readings accumulated for PUBLISH_BATCH as one message."""
+        if not self._batch:
+            return
+        body = b",".join(self._batch)
+        readings = len(self._batch)
+        self._batch.clear()
+        self._publish(body, readings, self._batch_last)
+
+    def _publish(self, body: bytes, readings: int, payload: bytes) -> None:
+        head, tail = self._envelope
+        message = head + body + tail if head else body
+        payload_bytes = len(message)
+        info = self.client.publish(self.topic, message, qos=QOS)
+        if info.rc == mqtt.MQTT_ERR_SUCCESS:
+            now = utcnow()
+            with self._lock:
+                self.metrics.messages_sent += readings
+                self.metrics.last_payload = payload
+                if not self.metrics.first_publish_at:
+                    self.metrics.first_publish_at = now
+                self.metrics.last_publish_at = now
+                self.metrics.last_issue = None
+            self._unflushed_messages += readings
+            self._unflushed_bytes += payload_bytes
+            if (
+                self._unflushed_messages >= COUNTER_FLUSH_EVERY
+                or time.monotonic() - self._flushed_at >= COUNTER_FLUSH_SECONDS
+            ):
+                self.flush_counters()
+        else:
+            reason = describe_error(info.rc)
+            self.record_error("publish", reason, info.rc)
+            self.collector.record_message_failed(self.name, reason)
+
+    def flush_counters(self) -> None:
+        if self._unflushed_messages:
+            self.collector.record_message_sent(self.name, self._unflushed_bytes, self._unflushed_messages)
+            self._unflushed_messages = 0
+            self._unflushed_bytes = 0
+        self._flushed_at = time.monotonic()
+
+    def drain(self) -> None:
+        """Publishes readings still waiting for a full batch and flushes the counters."""
+        try:
+            self.publish_batch()
+        except Exception as exc:  # noqa: BLE001
+            reason = classify_exception(exc)
+            self.record_error("runtime", f"{reason}: {exc.__class__.__name__}")
+        self.flush_counters()
+
+    def close(self) -> None:
+        self.drain()
+        if self.link is not None:
+            self.link.close()
+            return
+        try:
+            self.network.unregister(self.client)
+            self.client.disconnect()
+        except Exception:  # noqa: BLE001
+            pass
+
+
+class PublishScheduler(threading.Thread):
+    """Publishes for every SimLoop from one thread, each on its own monotonic deadline.
+
+    Socket I/O already lives in the NetworkLoop threads, so a thread per device
+    would only sleep between publishes.
+    """
+
+    def __init__(self, loops: List[SimLoop], interval: float):
+        super().__init__(daemon=True, name="publish-scheduler")
+        self.loops = loops
+        self.interval = interval
+        # Deadlines are integer nanoseconds, so they never accumulate rounding drift.
+        self.interval_ns = max(1, round(interval * 1_000_000_000))
+        self._stop_event = threading.Event()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def run(self) -> None:
+        pin_current_thread(1)
+        interval_ns = self.interval_ns
+        # Every device shares the first deadline, so the first burst is simultaneous.
+        start = time.monotonic_ns()
+        heap = [(start, index, loop) for index, loop in enumerate(self.loops)]
+        while heap and not STOPPED.is_set():
+            deadline, index, loop = heap[0]
+            delay_ns = deadline - time.monotonic_ns()
+            if delay_ns > 0:
+                if self._stop_event.wait(delay_ns / 1_000_000_000):
+                    break
+                continue
+            if not loop.tick():
+                heapq.heappop(heap)
+                continue
+            next_tick = deadline + interval_ns
+            now = time.monotonic_ns()
+            if now - next_tick > interval_ns:
+                # Too far behind: skip the missed ticks instead of publishing a burst.
+                next_tick = now
+            heapq.heapreplace(heap, (next_tick, index, loop))
 
 
 def stop(_sig, _frame) -> None:
-    if RUNNING.is_set():
+    if not STOPPED.is_set():
         LOGGER.info("Stop signal received, finishing simulation...")
-        RUNNING.clear()
+        STOPPED.set()
 
 
 signal.signal(signal.SIGINT, stop)
@@ -384,9 +921,13 @@ signal.signal(signal.SIGTERM, stop)
 
 
 def load_tokens() -> Dict[str, str]:
-    if not TOKENS_FILE.exists():
-        raise SystemExit(f"No existe {TOKENS_FILE}. Ejecuta scripts/create_devices.py primero.")
-    return json.loads(TOKENS_FILE.read_text(encoding="utf-8"))
+    try:
+        raw = TOKENS_FILE.read_bytes()
+    except FileNotFoundError:
+        raise SystemExit(f"No existe {TOKENS_FILE}. Ejecuta scripts/create_devices.py primero.") from None
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
 
 
 def ensure_dirs() -> None:
@@ -395,6 +936,12 @@ def ensure_dirs() -> None:
     PROVISION_DIR.mkdir(parents=True, exist_ok=True)
 
 
+def decode_payload(payload: bytes) -> Dict[str, object]:
+    if orjson is not None:
+        return orjson.loads(payload)
+    return json.loads(payload)
+
+
 def summarize(
     session_id: str,
     started_at: datetime,
@@ -413,6 +960,8 @@ def summarize(
             "host": MQTT_HOST,
             "port": MQTT_PORT,
             "tls": MQTT_TLS,
+            "qos": QOS,
+            "max_inflight": MAX_INFLIGHT,
         },
         "interval_seconds": INTERVAL,
         "device_count": len(loops),
@@ -428,7 +977,7 @@ def summarize(
             "connected_at": iso(metrics.connected_at),
             "first_publish_at": iso(metrics.first_publish_at),
             "last_publish_at": iso(metrics.last_publish_at),
-            "last_payload": metrics.last_payload,
+            "last_payload": decode_payload(metrics.last_payload) if metrics.last_payload else None,
             "disconnects": metrics.disconnects,
             "errors": metrics.errors,
             "last_issue": metrics.last_issue,
@@ -436,10 +985,14 @@ def summarize(
 
     summary["metrics"] = collector.summary()
 
+    blob = json.dumps(summary, ensure_ascii=False, indent=2).encode("utf-8")
     report_path = RUNS_DIR / f"{session_id}.json"
-    report_path.write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8")
+    report_path.write_bytes(blob)
+    # report_last_run.py may be reading latest.json, so it is replaced atomically.
     latest_path = RUNS_DIR / "latest.json"
-    latest_path.write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8")
+    tmp_path = latest_path.with_name(f".{latest_path.name}.tmp")
+    tmp_path.write_bytes(blob)
+    os.replace(tmp_path, latest_path)
     LOGGER.info("Resumen escrito en %s", report_path.relative_to(ROOT))
     return report_path
 
@@ -454,26 +1007,38 @@ def main() -> None:
 
     total = len(tokens)
     LOGGER.info(
-        "Lanzando %d clientes MQTT hacia %s:%s (TLS=%s, intervalo=%.2fs)",
+        "Lanzando %d clientes MQTT hacia %s:%s (TLS=%s, QoS=%d, intervalo=%.2fs)",
         total,
         MQTT_HOST,
         MQTT_PORT,
         MQTT_TLS,
+        QOS,
         INTERVAL,
     )
 
-    global thread_barrier
-    thread_barrier = threading.Barrier(total + 1)
     collector = MetricsCollector(total)
     metrics_host = os.getenv("METRICS_HOST", "0.0.0.0")
     metrics_port = int(os.getenv("METRICS_PORT", "5050"))
     refresh_ms = int(os.getenv("METRICS_REFRESH_MS", "2000"))
     profile_target = os.getenv("DEVICE_PROFILE_ID") or "3a022cf0-aae1-11f0-bea7-7bc7d3c79da2"
 
-    loops = [
-        SimLoop(name, token, session_id, collector) for name, token in sorted(tokens.items())
-    ]
+    if GATEWAY_TOKEN:
+        link_count = -(-total // GATEWAY_BATCH)
+        pool = ClientPool(min(link_count, max(1, NET_THREADS)))
+        links = [GatewayLink(index, session_id, pool.assign()) for index in range(link_count)]
+        loops = []
+        for index, (name, token) in enumerate(sorted(tokens.items())):
+            link = links[index // GATEWAY_BATCH]
+            loops.append(SimLoop(name, token, session_id, collector, link.network, link))
+        LOGGER.info("Modo gateway: %d conexiones de hasta %d dispositivos", link_count, GATEWAY_BATCH)
+    else:
+        pool = ClientPool(min(total, max(1, NET_THREADS)))
+        loops = [
+            SimLoop(name, token, session_id, collector, pool.assign())
+            for name, token in sorted(tokens.items())
+        ]
     reporter = MetricsReporter(collector, interval=10.0)
+    ticker = TimestampTicker(INTERVAL / 10)
 
     metrics_server: Optional[MetricsServer] = None
     try:
@@ -492,22 +1057,33 @@ def main() -> None:
         metrics_server = None
 
     started_at = utcnow()
-    for loop in loops:
-        loop.start()
-    reporter.start()
-
-    try:
-        thread_barrier.wait(timeout=30)
-        LOGGER.info("Primera rafaga de telemetria disparada.")
-    except Exception:  # noqa: BLE001
+    CURRENT_TS[0] = iso(started_at)
+    ticker.start()
+    pool.start()
+    # connect() blocks on the TCP handshake, so connections are opened in parallel.
+    with ThreadPoolExecutor(max_workers=min(total, max(1, NET_THREADS))) as executor:
+        connected = [loop for loop, ok in zip(loops, executor.map(SimLoop.connect, loops)) if ok]
+    if len(connected) < total:
         LOGGER.warning("No todos los clientes sincronizaron la primera publicacion.")
+    scheduler = PublishScheduler(connected, INTERVAL)
+    scheduler.start()
+    reporter.start()
+    LOGGER.info("Primera rafaga de telemetria disparada.")
 
     try:
-        while RUNNING.is_set():
-            time.sleep(0.5)
+        STOPPED.wait()
     finally:
+        scheduler.stop()
+        scheduler.join(timeout=5)
+        # Every loop drains while all connections (shared gateway links included)
+        # are still up; only then are they closed.
         for loop in loops:
-            loop.join(timeout=5)
+            loop.drain()
+        for loop in loops:
+            loop.close()
+        pool.stop()
+        ticker.stop()
+        ticker.join(timeout=5)
         reporter.stop()
         reporter.join(timeout=5)
         if metrics_server is not None:
@@ -4,6 +4,7 @@ from __future__ import annotations
 
 import argparse
 import os
+import select
 import signal
 import sys
 import time
@@ -84,7 +85,28 @@ def read_pid(path: Path) -> int:
         raise SystemExit(f"Contenido inválido en {path}: {text!r}") from exc
 
 
+def _wait_pidfd(pid: int, timeout: float) -> bool | None:
+    # Linux >= 5.3: bloquea hasta que el proceso termina, sin sondeo periódico.
+    if not hasattr(os, "pidfd_open") or not hasattr(select, "poll"):
+        return None
+    try:
+        pidfd = os.pidfd_open(pid, 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        return None
+    try:
+        poller = select.poll()
+        poller.register(pidfd, select.POLLIN)
+        return bool(poller.poll(max(0.0, timeout) * 1000))
+    finally:
+        os.close(pidfd)
+
+
 def wait_for_exit(pid: int, timeout: float) -> bool:
+    exited = _wait_pidfd(pid, timeout)
+    if exited is not None:
+        return exited
     deadline = time.monotonic() + max(0.0, timeout)
     while time.monotonic() < deadline:
         if not process_alive(pid):
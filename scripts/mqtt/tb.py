@@ -2,31 +2,167 @@
 """ThingsBoard helper client with short, shared calls."""
 from __future__ import annotations
 
+import base64
+import functools
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Any, Dict, Optional
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar, Union
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-TIMEOUT = 15
+try:
+    import orjson
+except ImportError:  # orjson es opcional; sin él se usa el módulo json estándar.
+    orjson = None  # type: ignore[assignment]
+
+LOGGER = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# (connect, read) en segundos. Conectar basta con algo más que una retransmisión TCP;
+# TB_CONNECT_TIMEOUT y TB_READ_TIMEOUT los ajustan al crear cada cliente.
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 15.0
+# El login verifica el hash de la contraseña y tolera una lectura más lenta.
+LOGIN_READ_TIMEOUT = 30.0
+POOL_SIZE = 32
+# Reintentos transparentes ante caídas de conexión, 429 y errores de proxy/gateway,
+# con backoff exponencial y respetando Retry-After. Los conflictos de negocio (400
+# "already exists") siguen resolviéndose en create_device.
+RETRY_POLICY = Retry(
+    total=5,
+    backoff_factor=0.3,
+    status_forcelist=(429, 502, 503, 504),
+    allowed_methods=frozenset(["GET", "POST", "DELETE"]),
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+SESSION_FILE = Path(__file__).resolve().parents[2] / "data" / ".tb_session.json"
+# Margen antes de la expiración del JWT a partir del cual se vuelve a iniciar sesión.
+SESSION_MARGIN = 60.0
+# Texto del campo "message" con el que ThingsBoard rechaza un nombre duplicado. Su
+# errorCode (31, parámetros inválidos) es genérico y no basta para distinguirlo.
+DUPLICATE_NAME_HINT = "already exists"
+# Marca "perfil por defecto aún no consultado" (None es un resultado válido).
+_UNSET: Any = object()
 
 
 class TBError(RuntimeError):
     """Raised when the remote ThingsBoard API returns an error."""
 
+    def __init__(self, message: str, status_code: Optional[int] = None) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _dumps(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value).encode("utf-8")
+
+
+def _parse(raw: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def _loads(resp: requests.Response) -> Any:
+    """Decodifica el cuerpo JSON directamente de los bytes de la respuesta."""
+    return _parse(resp.content)
+
+
+def _error_message(resp: requests.Response) -> str:
+    """Campo ``message`` del cuerpo de error de ThingsBoard; "" si no es JSON."""
+    try:
+        body = _loads(resp)
+    except ValueError:
+        return ""
+    return str(body.get("message", "")) if isinstance(body, dict) else ""
+
+
+def _jwt_expiry(token: str) -> float:
+    """Lee el claim ``exp`` del JWT sin verificar la firma; 0 si no se puede."""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(_parse(base64.urlsafe_b64decode(payload)).get("exp", 0))
+    except (IndexError, ValueError, AttributeError, TypeError):
+        return 0.0
+
 
 @dataclass
 class TB:
     base: str
     user: str
     password: str
-    timeout: int = TIMEOUT
+    timeout: Optional[Union[float, Tuple[float, float]]] = None
+    session_file: Optional[Path] = SESSION_FILE
 
     def __post_init__(self) -> None:
         base = self.base.rstrip("/")
         if not base or not self.user or not self.password:
             raise TBError("Se requieren TB_URL, TB_USERNAME y TB_PASSWORD")
         self.base = base
+        if self.timeout is None:
+            # Se lee aquí y no al importar: los scripts cargan el .env después de importar tb.
+            self.timeout = (
+                float(os.getenv("TB_CONNECT_TIMEOUT", CONNECT_TIMEOUT)),
+                float(os.getenv("TB_READ_TIMEOUT", READ_TIMEOUT)),
+            )
+        elif not isinstance(self.timeout, tuple):
+            # Un único número (la forma anterior) vale para conectar y para leer.
+            self.timeout = (float(self.timeout), float(self.timeout))
+        # Prefijos de las rutas que se llaman una vez por dispositivo.
+        self._url_device = base + "/api/device"
+        self._url_tenant_devices = base + "/api/tenant/devices"
+        self._url_attrs = base + "/api/plugins/telemetry/DEVICE/"
         self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=RETRY_POLICY
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # Los cuerpos se codifican con _dumps, así que el tipo se fija una sola vez.
+        self.session.headers["Content-Type"] = "application/json"
+        # El perfil por defecto no cambia durante la vida del cliente, y los
+        # dispositivos creados o encontrados se recuerdan por nombre; el índice
+        # por id permite olvidarlos cuando se borran (forget).
+        self._default_profile: Optional[str] = _UNSET
+        self._device_cache: Dict[str, Dict[str, Any]] = {}
+        self._device_names: Dict[str, str] = {}
+        # Un cliente de larga vida (get_tb) sobrevive a su JWT: ante un 401 se
+        # vuelve a iniciar sesión y se reenvía la petición una vez.
+        self._login_lock = threading.Lock()
+        self.session.hooks["response"].append(self._renew_on_401)
+
+    def _renew_on_401(self, resp: requests.Response, **kwargs: Any) -> Optional[requests.Response]:
+        request = resp.request
+        if (
+            resp.status_code != 401
+            or "/api/auth/" in (request.url or "")
+            or getattr(request, "_tb_renewed", False)
+        ):
+            return None
+        rejected = request.headers.get("X-Authorization")
+        with self._login_lock:
+            # Otro hilo pudo haber renovado el token mientras éste esperaba.
+            if self.session.headers.get("X-Authorization") == rejected:
+                self.login()
+        retry = request.copy()
+        retry.headers["X-Authorization"] = self.session.headers["X-Authorization"]
+        retry._tb_renewed = True  # type: ignore[attr-defined]
+        return self.session.send(retry, **kwargs)
 
     def close(self) -> None:
         self.session.close()
@@ -37,49 +173,140 @@ class TB:
     def __exit__(self, exc_type, exc, tb) -> None:  # type: ignore[override]
         self.close()
 
+    def map(
+        self, fn: Callable[["TB", T], R], items: Iterable[T], max_workers: int = POOL_SIZE
+    ) -> Iterator[R]:
+        """Aplica ``fn(self, item)`` en paralelo y entrega los resultados en orden.
+
+        Los hilos comparten la sesión, así que nunca se usan más que conexiones
+        tiene su pool. Si el llamador deja de iterar, lo pendiente se cancela.
+        """
+        executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, POOL_SIZE)))
+        try:
+            yield from executor.map(lambda item: fn(self, item), items)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    # Session cache -----------------------------------------------------
+    @property
+    def _session_key(self) -> str:
+        return f"{self.user}@{self.base}"
+
+    def _read_sessions(self) -> Dict[str, Any]:
+        if self.session_file is None:
+            return {}
+        try:
+            data = _parse(self.session_file.read_bytes())
+        except (OSError, ValueError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def _cached_token(self) -> Optional[str]:
+        """JWT guardado por una ejecución anterior, si sigue vigente en el servidor."""
+        entry = self._read_sessions().get(self._session_key)
+        if not isinstance(entry, dict):
+            return None
+        token = entry.get("token")
+        if not token or float(entry.get("expires_at", 0)) - SESSION_MARGIN <= time.time():
+            return None
+        self.session.headers["X-Authorization"] = f"Bearer {token}"
+        try:
+            resp = self.session.get(f"{self.base}/api/auth/user", timeout=self.timeout)
+        except requests.RequestException:
+            resp = None
+        if resp is None or resp.status_code != 200:
+            self.session.headers.pop("X-Authorization", None)
+            return None
+        return token
+
+    def _store_token(self, token: str, refresh: Optional[str]) -> None:
+        if self.session_file is None:
+            return
+        sessions = self._read_sessions()
+        sessions[self._session_key] = {
+            "token": token,
+            "refresh_token": refresh,
+            "expires_at": _jwt_expiry(token),
+        }
+        try:
+            self.session_file.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(
+                dir=self.session_file.parent, prefix=".tb_session-", suffix=".tmp"
+            )
+            with os.fdopen(fd, "wb") as handle:
+                handle.write(_dumps(sessions))
+            os.replace(tmp_name, self.session_file)
+        except OSError:
+            pass  # La caché es opcional; el login ya fue exitoso.
+
     # API helpers ---------------------------------------------------------
     def login(self) -> str:
+        cached = self._cached_token()
+        if cached:
+            return cached
         resp = self.session.post(
             f"{self.base}/api/auth/login",
-            json={"username": self.user, "password": self.password},
-            timeout=self.timeout,
+            data=_dumps({"username": self.user, "password": self.password}),
+            timeout=(self.timeout[0], max(self.timeout[1], LOGIN_READ_TIMEOUT)),
         )
         if resp.status_code != 200:
-            raise TBError(f"Login fallido: {resp.status_code} {resp.text}")
-        token = resp.json().get("token")
+            raise TBError(f"Login fallido: {resp.status_code} {resp.text}", resp.status_code)
+        data = _loads(resp)
+        token = data.get("token")
         if not token:
             raise TBError("No se obtuvo token JWT")
         self.session.headers.update({"X-Authorization": f"Bearer {token}"})
+        self._store_token(token, data.get("refreshToken"))
         return token
 
     def default_profile(self) -> Optional[str]:
+        if self._default_profile is _UNSET:
+            self._default_profile = self._fetch_default_profile()
+        return self._default_profile
+
+    def _fetch_default_profile(self) -> Optional[str]:
         for endpoint in ("deviceProfileInfos", "deviceProfiles"):
             resp = self.session.get(
                 f"{self.base}/api/{endpoint}?pageSize=100&page=0",
                 timeout=self.timeout,
             )
             if resp.status_code == 200:
-                data = resp.json().get("data", [])
-                for item in data:
-                    if item.get("default"):
-                        return item["id"]["id"]
+                found = next(
+                    (item["id"]["id"] for item in _loads(resp).get("data", []) if item.get("default")),
+                    None,
+                )
+                if found:
+                    return found
         return None
 
     def device(self, name: str) -> Optional[Dict[str, Any]]:
+        """Dispositivo llamado exactamente ``name``, o None si no existe."""
+        cached = self._device_cache.get(name)
+        if cached is not None:
+            return cached
+        device = self._fetch_device(name)
+        if device is not None:
+            self._remember(name, device)
+        return device
+
+    def _remember(self, name: str, device: Dict[str, Any]) -> None:
+        self._device_cache[name] = device
+        self._device_names[device["id"]["id"]] = name
+
+    def forget(self, device_id: str) -> None:
+        """Olvida el dispositivo ``device_id`` de la caché; se llama al borrarlo."""
+        name = self._device_names.pop(device_id, None)
+        if name is not None:
+            self._device_cache.pop(name, None)
+
+    def _fetch_device(self, name: str) -> Optional[Dict[str, Any]]:
         resp = self.session.get(
-            f"{self.base}/api/tenant/devices?deviceName={name}",
+            self._url_tenant_devices,
+            params={"deviceName": name},
             timeout=self.timeout,
         )
         if resp.status_code == 200 and resp.text and resp.text != "null":
-            return resp.json()
-        resp = self.session.get(
-            f"{self.base}/api/tenant/devices?limit=100&page=0&textSearch={name}",
-            timeout=self.timeout,
-        )
-        if resp.status_code == 200:
-            for item in resp.json().get("data", []):
-                if item.get("name") == name:
-                    return item
+            return _loads(resp)
         return None
 
     def save_device(
@@ -89,31 +316,64 @@ class TB:
         label: str,
         dev_type: str,
         profile_id: Optional[str] = None,
+        assume_exists: bool = False,
     ) -> Dict[str, Any]:
+        device, _created = self.create_device(
+            name, label=label, dev_type=dev_type, profile_id=profile_id, assume_exists=assume_exists
+        )
+        return device
+
+    def create_device(
+        self,
+        name: str,
+        *,
+        label: str,
+        dev_type: str,
+        profile_id: Optional[str] = None,
+        access_token: Optional[str] = None,
+        assume_exists: bool = False,
+    ) -> Tuple[Dict[str, Any], bool]:
+        """Create ``name`` or reuse it if it exists; returns ``(device, created)``.
+
+        When ``access_token`` is given, ThingsBoard assigns it to a newly created
+        device, so the caller can skip the credentials lookup. With
+        ``assume_exists`` (or a name already cached) the device is looked up
+        first and only POSTed on a miss, so re-runs avoid a create that would fail.
+        """
+        if assume_exists or name in self._device_cache:
+            existing = self.device(name)
+            if existing:
+                return existing, False
         payload: Dict[str, Any] = {"name": name, "label": label, "type": dev_type}
         if profile_id:
             payload["deviceProfileId"] = {"id": profile_id, "entityType": "DEVICE_PROFILE"}
         resp = self.session.post(
-            f"{self.base}/api/device",
-            json=payload,
+            self._url_device,
+            params={"accessToken": access_token} if access_token else None,
+            data=_dumps(payload),
             timeout=self.timeout,
         )
         if resp.status_code == 200:
-            return resp.json()
-        if resp.status_code == 400 and "already" in resp.text.lower():
+            device = _loads(resp)
+            self._remember(name, device)
+            return device, True
+        if resp.status_code == 400 and DUPLICATE_NAME_HINT in _error_message(resp):
             existing = self.device(name)
             if existing:
-                return existing
-        raise TBError(f"No se pudo crear o recuperar '{name}': {resp.status_code} {resp.text}")
+                return existing, False
+        raise TBError(
+            f"No se pudo crear o recuperar '{name}': {resp.status_code} {resp.text}",
+            resp.status_code,
+        )
 
     def token(self, device_id: str) -> str:
         resp = self.session.get(
-            f"{self.base}/api/device/{device_id}/credentials",
+            self._url_device + "/" + device_id + "/credentials",
             timeout=self.timeout,
         )
         if resp.status_code != 200:
-            raise TBError(f"Error credenciales: {resp.status_code} {resp.text}")
-        data = resp.json()
+            raise TBError(f"Error credenciales: {resp.status_code} {resp.text}", resp.status_code)
+        data = _loads(resp)
         if data.get("credentialsType") != "ACCESS_TOKEN":
             raise TBError("Credencial no es ACCESS_TOKEN")
         token = data.get("credentialsId")
@@ -121,16 +381,80 @@ class TB:
             raise TBError("credentialsId vacío")
         return token
 
-    def set_attrs(self, device_id: str, attrs: Dict[str, Any]) -> bool:
+    def delete_devices(
+        self, device_ids: Iterable[str], workers: int = 8
+    ) -> Iterator[Tuple[str, int, str]]:
+        """Borra varios dispositivos y entrega ``(id, status_code, detalle)`` en orden.
+
+        Los DELETE se solapan sobre las conexiones keep-alive del pool, de modo
+        que el borrado masivo no espera un RTT por dispositivo. El detalle es el
+        cuerpo de la respuesta cuando el código no es 200.
+        """
+
+        def _delete(api: "TB", device_id: str) -> Tuple[str, int, str]:
+            resp = api.session.delete(api._url_device + "/" + device_id, timeout=api.timeout)
+            if resp.status_code in (200, 404):
+                # Ya no existe: create_device no debe reutilizarlo desde la caché.
+                api.forget(device_id)
+            return device_id, resp.status_code, "" if resp.status_code == 200 else resp.text
+
+        return self.map(_delete, device_ids, workers)
+
+    def _post_attrs(self, device_id: str, attrs: Dict[str, Any]) -> Optional[str]:
+        """Guarda atributos SERVER_SCOPE; devuelve el detalle del error o None si se guardaron."""
         resp = self.session.post(
-            f"{self.base}/api/plugins/telemetry/DEVICE/{device_id}/SERVER_SCOPE",
-            json=attrs,
+            self._url_attrs + device_id + "/SERVER_SCOPE",
+            data=_dumps(attrs),
             timeout=self.timeout,
         )
         if resp.status_code != 200:
-            print(f"[WARN] No se guardaron attrs para {device_id}: {resp.status_code} {resp.text}")
+            return f"{resp.status_code} {resp.text}"
+        return None
+
+    def set_attrs(self, device_id: str, attrs: Dict[str, Any]) -> bool:
+        error = self._post_attrs(device_id, attrs)
+        if error is not None:
+            LOGGER.warning("No se guardaron attrs para %s: %s", device_id, error)
             return False
         return True
 
+    def set_attrs_bulk(self, updates: Dict[str, Dict[str, Any]], workers: int = 8) -> List[str]:
+        """Guarda los atributos de varios dispositivos; devuelve los ids que fallaron.
+
+        ThingsBoard no tiene un endpoint de atributos para varias entidades, así que
+        cada dispositivo sigue siendo un POST, pero se lanzan en paralelo sobre el
+        pool keep-alive de la sesión y los fallos se resumen en un único aviso.
+        """
+        if not updates:
+            return []
+        errors = list(
+            self.map(
+                lambda api, item: api._post_attrs(*item), updates.items(), min(workers, len(updates))
+            )
+        )
+        failed = [device_id for device_id, error in zip(updates, errors) if error is not None]
+        if failed:
+            first_error = next(error for error in errors if error is not None)
+            LOGGER.warning(
+                "No se guardaron attrs para %d de %d dispositivos (primero %s: %s)",
+                len(failed),
+                len(updates),
+                failed[0],
+                first_error,
+            )
+        return failed
+
+
+@functools.lru_cache(maxsize=4)
+def get_tb(base: str, user: str, password: str) -> TB:
+    """Cliente ya autenticado, compartido por todo el proceso para esas credenciales.
+
+    Evita abrir otra sesión HTTP y repetir el login en cada llamada de funciones
+    de biblioteca como ``toggle_devices.execute_toggle``. No se debe cerrar.
+    """
+    api = TB(base, user, password)
+    api.login()
+    return api
+
 
-__all__ = ["TB", "TBError"]
+__all__ = ["TB", "TBError", "get_tb"]
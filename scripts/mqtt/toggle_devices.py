@@ -3,17 +3,36 @@
 from __future__ import annotations
 
 import argparse
+import bisect
 import csv
 import json
 import os
+import pickle
 import sys
+import tempfile
+from collections.abc import MutableSet
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, Iterable, List, Set, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple
 
 from dotenv import load_dotenv
 
-from tb import TB, TBError
+from tb import TB, TBError, get_tb
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional; se usa json de la librería estándar.
+    orjson = None  # type: ignore[assignment]
+
+try:
+    import msgpack
+except ImportError:  # msgpack es opcional; sólo se necesita para archivos .msgpack.
+    msgpack = None  # type: ignore[assignment]
+
+try:
+    from sortedcontainers import SortedSet
+except ImportError:  # sortedcontainers es opcional; se usa SortedNames.
+    SortedSet = None  # type: ignore[assignment,misc]
 
 
 load_dotenv(override=True)
@@ -23,39 +42,155 @@ DATA_DIR = ROOT / "data"
 PROVISION_DIR = DATA_DIR / "provisioning"
 CONTROL_DIR = DATA_DIR / "control"
 CSV_FILE = PROVISION_DIR / "devices.csv"
-DISABLED_FILE = CONTROL_DIR / "disabled_devices.json"
+DISABLED_FILE = Path(os.getenv("DISABLED_DEVICES_FILE") or CONTROL_DIR / "disabled_devices.json")
+# Con esta extensión el snapshot de desactivados se guarda en msgpack en lugar de JSON.
+MSGPACK_SUFFIX = ".msgpack"
+DISABLED_NOTE = "Archivo generado por toggle_devices.py. Editar con cuidado."
 
 TB_URL = os.getenv("TB_URL", "").rstrip("/")
 TB_USERNAME = os.getenv("TB_USERNAME")
 TB_PASSWORD = os.getenv("TB_PASSWORD")
+# Al superar este tamaño, el log de cambios se consolida en disabled_devices.json.
+DISABLED_LOG_MAX_BYTES = 1024 * 1024
+# TB.map limita los hilos al pool de conexiones de la sesión (tb.POOL_SIZE).
+TOGGLE_WORKERS = int(os.getenv("TOGGLE_WORKERS", "8"))
+# Hasta esta cantidad de --devices se recorre el CSV sólo hasta encontrarlos.
+SUBSET_LOOKUP_LIMIT = 10
 
 
 def utcnow() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
-def load_devices(csv_path: Path) -> Dict[str, Dict[str, str]]:
+def _json_loads(data: bytes | str) -> object:
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+class DeviceRecord(NamedTuple):
+    id: str
+    label: str
+    token: str
+
+
+def _column(header: Sequence[str], *names: str) -> Optional[int]:
+    for name in names:
+        if name in header:
+            return header.index(name)
+    return None
+
+
+def _iter_device_rows(csv_path: Path) -> Iterator[Tuple[str, DeviceRecord]]:
     if not csv_path.exists():
         raise SystemExit(f"No se encontró {csv_path}. Ejecuta primero create_devices.py.")
-    devices: Dict[str, Dict[str, str]] = {}
     with csv_path.open(encoding="utf-8", newline="") as handle:
-        reader = csv.DictReader(handle)
+        reader = csv.reader(handle)
+        header = next(reader, [])
+        idx_name = _column(header, "name", "device_name")
+        idx_id = _column(header, "device_id", "id")
+        idx_label = _column(header, "label")
+        idx_token = _column(header, "access_token")
+        if idx_name is None or idx_id is None:
+            raise SystemExit(f"{csv_path} no tiene columnas de nombre e ID de dispositivo.")
+        width = max(idx for idx in (idx_name, idx_id, idx_label, idx_token) if idx is not None) + 1
         for row in reader:
-            name = row.get("name") or row.get("device_name")
-            dev_id = row.get("device_id") or row.get("id")
+            if len(row) < width:
+                row = row + [""] * (width - len(row))
+            name = row[idx_name]
+            dev_id = row[idx_id]
             if not name or not dev_id:
                 continue
-            devices[name] = {"id": dev_id, "label": row.get("label", ""), "token": row.get("access_token", "")}
+            yield name, DeviceRecord(
+                dev_id,
+                row[idx_label] if idx_label is not None else "",
+                row[idx_token] if idx_token is not None else "",
+            )
+
+
+def load_devices(csv_path: Path) -> Tuple[Dict[str, DeviceRecord], Tuple[str, ...]]:
+    devices: Dict[str, DeviceRecord] = dict(_iter_device_rows(csv_path))
     if not devices:
         raise SystemExit(f"{csv_path} no contiene dispositivos válidos.")
-    return devices
+    return devices, tuple(sorted(devices))
+
+
+def load_devices_subset(csv_path: Path, wanted: Iterable[str]) -> Dict[str, DeviceRecord]:
+    """Busca sólo ``wanted`` en el CSV y deja de leer en cuanto aparecen todos.
+
+    Los nombres que no estén en el CSV quedan fuera; execute_toggle los resuelve vía API.
+    """
+    pending = set(wanted)
+    found: Dict[str, DeviceRecord] = {}
+    if not pending:
+        return found
+    for name, record in _iter_device_rows(csv_path):
+        if name in pending:
+            found[name] = record
+            pending.discard(name)
+            if not pending:
+                break
+    return found
+
+
+def _devices_cache_path(csv_path: Path) -> Path:
+    return csv_path.with_name(f"{csv_path.stem}.cache.pkl")
+
+
+def load_devices_cached(csv_path: Path) -> Tuple[Dict[str, DeviceRecord], Tuple[str, ...]]:
+    """Like load_devices(), reusing a pickle sidecar while the CSV is unchanged."""
+    try:
+        stat = csv_path.stat()
+    except FileNotFoundError:
+        return load_devices(csv_path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    cache_path = _devices_cache_path(csv_path)
+    try:
+        with cache_path.open("rb") as handle:
+            cached = pickle.load(handle)
+        if cached.get("key") == key:
+            # Se guardan tuplas simples para no depender del módulo que definió DeviceRecord.
+            devices = {name: DeviceRecord._make(values) for name, values in cached["devices"].items()}
+            return devices, tuple(cached["sorted_names"])
+    except (OSError, pickle.PickleError, EOFError, AttributeError, KeyError, TypeError, ValueError):
+        pass
+
+    devices, sorted_names = load_devices(csv_path)
+    payload = {
+        "key": key,
+        "devices": {name: tuple(record) for name, record in devices.items()},
+        "sorted_names": sorted_names,
+    }
+    try:
+        fd, tmp_name = tempfile.mkstemp(dir=cache_path.parent, prefix=".devices-", suffix=".tmp")
+        with os.fdopen(fd, "wb") as handle:
+            pickle.dump(payload, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_name, cache_path)
+    except OSError as exc:
+        print(f"[WARN] No se pudo escribir la caché {cache_path}: {exc}", file=sys.stderr)
+    return devices, sorted_names
+
+
+def names_with_prefix(sorted_names: Sequence[str], prefix: str) -> List[str]:
+    """Return the contiguous run of ``sorted_names`` starting with ``prefix``."""
+    start = bisect.bisect_left(sorted_names, prefix)
+    upper = _prefix_upper_bound(prefix)
+    end = bisect.bisect_left(sorted_names, upper, start) if upper is not None else len(sorted_names)
+    return list(sorted_names[start:end])
+
+
+def _prefix_upper_bound(prefix: str) -> Optional[str]:
+    """Smallest string greater than every string starting with ``prefix``."""
+    stripped = prefix.rstrip("\U0010ffff")
+    if not stripped:
+        return None
+    return stripped[:-1] + chr(ord(stripped[-1]) + 1)
 
 
 def target_devices(
-    devices_map: Dict[str, Dict[str, str]],
+    devices_map: Dict[str, DeviceRecord],
     explicit: Iterable[str] | None,
     prefix: str | None,
     include_all: bool,
+    sorted_names: Sequence[str] | None = None,
 ) -> List[str]:
     if explicit:
         targets = []
@@ -65,18 +200,92 @@ def target_devices(
             targets.append(name)
         return targets
     if prefix:
-        return [name for name in devices_map if name.startswith(prefix)]
+        if sorted_names is not None:
+            return names_with_prefix(sorted_names, prefix)
+        size = len(prefix)
+        return [name for name in devices_map if name[:size] == prefix]
     if include_all:
-        return sorted(devices_map.keys())
+        return list(sorted_names) if sorted_names is not None else sorted(devices_map.keys())
     raise SystemExit("Debes indicar --devices, --prefix o --all.")
 
 
-def load_disabled(path: Path) -> Set[str]:
+class SortedNames(MutableSet):
+    """Conjunto de nombres que conserva también su orden, sin reordenar al guardar."""
+
+    def __init__(self, items: Iterable[str] = ()) -> None:
+        self._members: Set[str] = set(items)
+        self._order: List[str] = sorted(self._members)
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._members
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._order)
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    def add(self, name: str) -> None:
+        if name not in self._members:
+            self._members.add(name)
+            bisect.insort(self._order, name)
+
+    def discard(self, name: str) -> None:
+        if name in self._members:
+            self._members.remove(name)
+            del self._order[bisect.bisect_left(self._order, name)]
+
+
+_SORTED_SET_TYPES: Tuple[type, ...] = (SortedNames,) if SortedSet is None else (SortedNames, SortedSet)
+
+
+def sorted_name_set(items: Iterable[str] = ()) -> MutableSet:
+    return SortedSet(items) if SortedSet is not None else SortedNames(items)
+
+
+def _is_msgpack(path: Path) -> bool:
+    if path.suffix != MSGPACK_SUFFIX:
+        return False
+    if msgpack is None:
+        raise SystemExit(f"{path} usa formato msgpack; instala el paquete 'msgpack'.")
+    return True
+
+
+def disabled_log_path(path: Path) -> Path:
+    return path.with_suffix(".log")
+
+
+def _replay_disabled_log(log_path: Path, disabled: MutableSet) -> None:
     try:
-        data = json.loads(path.read_text(encoding="utf-8"))
+        handle = log_path.open(encoding="utf-8")
     except FileNotFoundError:
-        return set()
-    except json.JSONDecodeError as exc:
+        return
+    with handle:
+        for line in handle:
+            try:
+                entry = _json_loads(line)
+            except json.JSONDecodeError:
+                continue  # Línea truncada por una escritura interrumpida.
+            if not isinstance(entry, dict):
+                continue
+            name = str(entry.get("name", ""))
+            if not name:
+                continue
+            if entry.get("action") == "enable":
+                disabled.discard(name)
+            else:
+                disabled.add(name)
+
+
+def load_disabled(path: Path) -> MutableSet:
+    """Snapshot JSON + cambios pendientes del log JSONL asociado, en orden alfabético."""
+    use_msgpack = _is_msgpack(path)
+    try:
+        raw = path.read_bytes()
+        data = msgpack.unpackb(raw, raw=False) if use_msgpack else _json_loads(raw)
+    except FileNotFoundError:
+        data = []
+    except ValueError as exc:  # JSONDecodeError y los errores de msgpack heredan de ValueError.
         raise SystemExit(f"Archivo inválido {path}: {exc}") from exc
     if isinstance(data, dict):
         items = data.get("disabled", [])
@@ -84,17 +293,66 @@ def load_disabled(path: Path) -> Set[str]:
         items = data
     else:
         items = []
-    return {str(item) for item in items}
+    disabled = sorted_name_set(str(item) for item in items)
+    _replay_disabled_log(disabled_log_path(path), disabled)
+    return disabled
+
+
+def append_disabled_changes(
+    path: Path, names: Iterable[str], enable: bool, ts: str | None = None
+) -> None:
+    """Registra los cambios en el log JSONL sin reescribir el snapshot completo."""
+    action = "enable" if enable else "disable"
+    ts = ts or utcnow()
+    lines = [
+        json.dumps({"ts": ts, "name": name, "action": action}, ensure_ascii=False) + "\n"
+        for name in names
+    ]
+    if not lines:
+        return
+    log_path = disabled_log_path(path)
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    with log_path.open("a", encoding="utf-8") as handle:
+        handle.write("".join(lines))
+
 
+# Mismo formato que json.dumps(..., indent=2); sólo la lista y la fecha cambian.
+_DISABLED_TEMPLATE = (
+    '{{\n  "disabled": {names},\n  "updated_at": {ts},\n  "note": '
+    + json.dumps(DISABLED_NOTE, ensure_ascii=False)
+    + "\n}}"
+)
 
-def save_disabled(path: Path, disabled: Set[str]) -> None:
+
+def _render_disabled(ordered: List[str], ts: str) -> bytes:
+    if ordered:
+        # Un solo json.dumps (codificador en C) con el separador del formato indentado.
+        names = json.dumps(ordered, ensure_ascii=False, separators=(",\n    ", ": "))
+        names = f"[\n    {names[1:-1]}\n  ]"
+    else:
+        names = "[]"
+    return _DISABLED_TEMPLATE.format(names=names, ts=json.dumps(ts)).encode("utf-8")
+
+
+def save_disabled(path: Path, disabled: Iterable[str]) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
-    payload = {
-        "disabled": sorted(disabled),
-        "updated_at": utcnow(),
-        "note": "Archivo generado por toggle_devices.py. Editar con cuidado.",
-    }
-    path.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+    ordered = list(disabled) if isinstance(disabled, _SORTED_SET_TYPES) else sorted(disabled)
+    if _is_msgpack(path):
+        blob = msgpack.packb(
+            {"disabled": ordered, "updated_at": utcnow(), "note": DISABLED_NOTE}, use_bin_type=True
+        )
+    else:
+        blob = _render_disabled(ordered, utcnow())
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_bytes(blob)
+    os.replace(tmp_path, path)
+
+
+def compact_disabled(path: Path, disabled: Iterable[str]) -> None:
+    # Reproducir el log sobre un snapshot que ya lo incluye es idempotente, así que
+    # un corte entre ambos pasos no pierde ni duplica cambios.
+    save_disabled(path, disabled)
+    disabled_log_path(path).unlink(missing_ok=True)
 
 
 def fetch_device(api: TB, name: str) -> Tuple[str, str]:
@@ -106,13 +364,16 @@ def fetch_device(api: TB, name: str) -> Tuple[str, str]:
     return dev_id, label
 
 
-def toggle_device(api: TB, dev_id: str, enable: bool) -> bool:
-    attrs = {
+def toggle_attrs(enable: bool, ts: str | None = None) -> Dict[str, Any]:
+    return {
         "manual_enabled": enable,
         "manual_state": "enabled" if enable else "disabled",
-        "manual_updated_at": utcnow(),
+        "manual_updated_at": ts or utcnow(),
     }
-    return api.set_attrs(dev_id, attrs)
+
+
+def toggle_device(api: TB, dev_id: str, enable: bool, ts: str | None = None) -> bool:
+    return api.set_attrs(dev_id, toggle_attrs(enable, ts))
 
 
 def parse_args() -> argparse.Namespace:
@@ -152,6 +413,12 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Muestra qué sucedería sin aplicar cambios en ThingsBoard ni en el archivo local.",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=TOGGLE_WORKERS,
+        help=f"Peticiones simultáneas hacia ThingsBoard (default {TOGGLE_WORKERS}).",
+    )
     return parser.parse_args()
 
 
@@ -164,12 +431,18 @@ def execute_toggle(
     csv_path: Path,
     disabled_file: Path,
     dry_run: bool,
+    workers: int = TOGGLE_WORKERS,
 ) -> None:
     if not TB_URL or not TB_USERNAME or not TB_PASSWORD:
         raise SystemExit("Config .env incompleta (TB_URL, TB_USERNAME, TB_PASSWORD)")
 
-    devices_map = load_devices(csv_path)
-    targets = target_devices(devices_map, devices, prefix, include_all)
+    explicit = list(devices) if devices else []
+    sorted_names: Optional[Tuple[str, ...]] = None
+    if explicit and len(explicit) <= SUBSET_LOOKUP_LIMIT:
+        devices_map = load_devices_subset(csv_path, explicit)
+    else:
+        devices_map, sorted_names = load_devices_cached(csv_path)
+    targets = target_devices(devices_map, explicit, prefix, include_all, sorted_names)
     if not targets:
         print("[INFO] No se encontraron dispositivos que coincidan con los criterios proporcionados.")
         return
@@ -193,29 +466,62 @@ def execute_toggle(
 
     updated = 0
     missing = 0
-    with TB(TB_URL, TB_USERNAME, TB_PASSWORD) as api:
-        api.login()
-        for name in targets:
-            try:
-                info = devices_map.get(name)
-                if info is None:
-                    dev_id, label = fetch_device(api, name)
-                else:
-                    dev_id = info["id"]
-                    label = info.get("label", "")
-                toggle_device(api, dev_id, enable)
-                if enable:
-                    disabled_set.discard(name)
-                else:
-                    disabled_set.add(name)
-                print(f"[OK] {name} ({label}) -> {'activo' if enable else 'inactivo'}")
-                updated += 1
-            except TBError as exc:
-                print(f"[ERR] {name}: {exc}", file=sys.stderr)
-                missing += 1
-
-    save_disabled(disabled_file, disabled_set)
-    print(f"[INFO] Archivo actualizado: {disabled_file}")
+    changed: List[str] = []
+    # Una única marca de tiempo para todo el lote.
+    ts = utcnow()
+    api = get_tb(TB_URL, TB_USERNAME, TB_PASSWORD)
+
+    def _resolve(api: TB, name: str) -> Tuple[str, str, str, Optional[str]]:
+        info = devices_map.get(name)
+        if info is not None:
+            return name, info.id, info.label, None
+        try:
+            dev_id, label = fetch_device(api, name)
+        except TBError as exc:
+            return name, "", "", str(exc)
+        return name, dev_id, label, None
+
+    # Sólo los nombres ausentes del CSV consultan ThingsBoard; esas búsquedas
+    # van en paralelo.
+    resolved = list(api.map(_resolve, targets, workers))
+    # Todos reciben los mismos atributos, enviados en un solo lote.
+    attrs = toggle_attrs(enable, ts)
+    failed = set(
+        api.set_attrs_bulk(
+            {dev_id: attrs for _name, dev_id, _label, error in resolved if error is None},
+            workers,
+        )
+    )
+    # El estado local se actualiza sólo desde este hilo, en el orden original de los objetivos.
+    for name, dev_id, label, error in resolved:
+        if error is None and dev_id in failed:
+            error = "ThingsBoard no guardó los atributos"
+        if error is not None:
+            print(f"[ERR] {name}: {error}", file=sys.stderr)
+            missing += 1
+            continue
+        # Sólo se registran los nombres cuyo estado local cambia realmente.
+        if enable and name in disabled_set:
+            disabled_set.discard(name)
+            changed.append(name)
+        elif not enable and name not in disabled_set:
+            disabled_set.add(name)
+            changed.append(name)
+        print(f"[OK] {name} ({label}) -> {'activo' if enable else 'inactivo'}")
+        updated += 1
+
+    log_path = disabled_log_path(disabled_file)
+    if not changed:
+        print(f"[INFO] Sin cambios en el estado local: {disabled_file}")
+    else:
+        append_disabled_changes(disabled_file, changed, enable, ts)
+        if not disabled_file.exists() or (
+            log_path.exists() and log_path.stat().st_size > DISABLED_LOG_MAX_BYTES
+        ):
+            compact_disabled(disabled_file, disabled_set)
+            print(f"[INFO] Archivo actualizado: {disabled_file}")
+        else:
+            print(f"[INFO] Cambios registrados en: {log_path}")
     if missing:
         print(f"[WARN] {missing} dispositivo(s) no pudieron actualizarse; revisa los mensajes anteriores.")
     print(f"[DONE] {updated} dispositivo(s) procesados correctamente.")
@@ -231,6 +537,7 @@ def main() -> None:
         csv_path=parsed.csv,
         disabled_file=parsed.disabled_file,
         dry_run=parsed.dry_run,
+        workers=parsed.workers,
     )
 
 